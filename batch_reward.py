@@ -0,0 +1,119 @@
+# Work out the reward for a whole batch of steps at once, with numpy, rather than calling the reward function once per
+# step. Gives exactly the same booleans, rule numbers, reward levels and scores as reward_function.reward_function()
+# would, so it can be used to re-score logged training runs when designing a reward function.
+#
+# A batch is a dictionary of the same keys as the params of the reward function, but each value is an array with one
+# item per step. 'closest_waypoints' is an (N, 2) array. 'waypoints' is the list of waypoints of the track, which is
+# the same for every step in the batch.
+
+import numpy as np
+import reward_function as rf
+
+CLOSEST_WAYPOINTS_BATCH_SIZE = 10000            # Steps at a time, to limit memory used for the distances.
+
+
+# Return an array of the direction of the track, in degrees, between each pair of closest waypoints.
+# Directions are looked up from the TrackGeometry where possible, the same as Agent.check_direction() does, from the
+# same cache of them that the reward function uses.
+def track_directions(waypoints, closest_waypoints):
+    geometry = rf.get_track_geometry(rf.track_fingerprint(rf.waypoints_text(waypoints)), waypoints)
+    prev_waypoint = closest_waypoints[:, 0]
+    next_waypoint = closest_waypoints[:, 1]
+    directions = np.array(geometry.headings)[prev_waypoint]
+
+    # The odd pair of closest waypoints that aren't next to each other.
+    other = next_waypoint != (prev_waypoint + 1) % len(waypoints)
+    if other.any():
+        pairs = np.unique(closest_waypoints[other], axis=0)
+        for [p, n] in pairs.tolist():
+            directions[(prev_waypoint == p) & (next_waypoint == n)] = rf.segment_heading(waypoints[p], waypoints[n])
+
+    return directions
+
+
+# Return a dictionary of the Agent booleans -> boolean arrays, for the parm batch.
+def check_predicates(batch):
+    track_width = np.asarray(batch['track_width'], dtype=np.float64)
+    distance_from_center = np.asarray(batch['distance_from_center'], dtype=np.float64)
+    heading = np.asarray(batch['heading'], dtype=np.float64)
+    speed = np.asarray(batch['speed'], dtype=np.float64)
+    steering_angle = np.asarray(batch['steering_angle'], dtype=np.float64)
+    is_left_of_center = np.asarray(batch['is_left_of_center'], dtype=bool)
+    closest_waypoints = np.asarray(batch['closest_waypoints'], dtype=np.int64).reshape(-1, 2)
+
+    predicates = {'all_wheels_on_track': np.asarray(batch['all_wheels_on_track'], dtype=bool)}
+
+    # Agent.check_track_position()
+    predicates['near_centre_of_track'] = distance_from_center <= rf.NEAR_CENTRE * track_width
+    predicates['quite_near_centre_of_track'] = distance_from_center <= rf.QUITE_NEAR_CENTRE * track_width
+
+    # Agent.check_direction()
+    direction_diff = np.abs(track_directions(batch['waypoints'], closest_waypoints) - heading)
+    predicates['heading_in_right_direction'] = direction_diff < rf.DIRECTION_THRESHOLD
+
+    # Agent.check_speed()
+    predicates['going_fast'] = speed > rf.FAST * rf.MAX_SPEED
+    predicates['going_slowly'] = speed <= rf.SLOW * rf.MAX_SPEED
+
+    # Agent.check_steering()
+    predicates['turning_hard'] = np.abs(steering_angle) > rf.MAX_STEER * rf.HARD_STEER
+    predicates['going_straight'] = steering_angle == 0.0
+
+    # Agent.check_correcting_course()
+    predicates['correcting_course'] = ((is_left_of_center & (steering_angle < 0))
+                                       | (~is_left_of_center & (steering_angle > 0)))
+
+    return predicates
+
+
+# Score every step of the parm batch. Returns a dictionary of the Agent booleans, plus 'rule_number', 'reward_level'
+# and 'score', each an array with one item per step. The rules are looked up in parm outcomes, as made by
+# reward_function.compile_rules(), which defaults to those of reward_function.RULES.
+def batch_reward(batch, outcomes=None):
+    if outcomes is None:
+        outcomes = rf.RULE_OUTCOMES
+    output = check_predicates(batch)
+
+    # Pack the booleans into predicate masks, the same as Agent.predicate_mask() does.
+    masks = np.zeros(len(output['going_fast']), dtype=np.int64)
+    for (bit, name) in enumerate(rf.PREDICATES):
+        masks |= output[name].astype(np.int64) << bit
+
+    output['rule_number'] = np.array([number for (number, _, _, _) in outcomes], dtype=np.int64)[masks]
+    output['reward_level'] = np.array([level for (_, _, level, _) in outcomes])[masks]
+    output['score'] = np.array([score for (_, _, _, score) in outcomes], dtype=np.float64)[masks]
+    return output
+
+
+# Work out the closest waypoints, [previous, next], for each of the parm arrays of car x and y positions. The nearest
+# waypoint is found first, then whether the car is before or after it, along the track.
+def find_closest_waypoints(x, y, waypoints):
+    points = np.array(waypoints, dtype=np.float64).reshape(-1, 2)
+    count = len(points)
+    cars = np.column_stack([x, y]).astype(np.float64)
+    nearest = np.zeros(len(cars), dtype=np.int64)
+
+    for start in range(0, len(cars), CLOSEST_WAYPOINTS_BATCH_SIZE):
+        chunk = cars[start:start + CLOSEST_WAYPOINTS_BATCH_SIZE]
+        distances = ((chunk[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+        nearest[start:start + len(chunk)] = distances.argmin(axis=1)
+
+    # If the car is past the nearest waypoint, in the direction of the track, it is between that and the next one.
+    following = (nearest + 1) % count
+    along = ((cars - points[nearest]) * (points[following] - points[nearest])).sum(axis=1)
+    prev_waypoint = np.where(along >= 0, nearest, (nearest - 1) % count)
+    return np.column_stack([prev_waypoint, (prev_waypoint + 1) % count])
+
+
+# Make a batch out of a parse_logs.StatusColumns of statuses and the track's list of waypoint dictionaries (as made by
+# parse_logs.make_waypoints()). The logs don't say which waypoints were closest, so they are worked out from the
+# car's position.
+def batch_from_statuses(statuses, waypoints):
+    waypoints = [[w['x'], w['y']] for w in waypoints]
+    batch = {}
+    for name in ['all_wheels_on_track', 'x', 'y', 'distance_from_center', 'is_left_of_center', 'heading',
+                 'progress', 'steps', 'speed', 'steering_angle', 'track_width']:
+        batch[name] = statuses.values(name)
+    batch['waypoints'] = waypoints
+    batch['closest_waypoints'] = find_closest_waypoints(batch['x'], batch['y'], waypoints)
+    return batch
@@ -0,0 +1,181 @@
+# Benchmark of parsing logs and visualising them, for logs of increasing size, so that anything that gets slower
+# faster than the logs get bigger shows up.
+# Synthetic logs are made by repeating truncated_simulation_log.txt until it has the wanted number of steps. That log
+# has the waypoints on every step, so by default only those at the start of each episode are kept, the same as
+# reward_function.py now writes them (see WAYPOINTS_MODE). Each log is then parsed, and the time taken, the peak memory
+# used, the time for Track.find_min_max_dimensions() and the frames per second of Visualise.draw_all_elements() (with
+# no window) are measured. The results are written to a JSON report.
+#
+# To benchmark the default sizes of log,
+#   python bench_parse_logs.py
+# To benchmark other sizes, in steps, and write the report somewhere else,
+#   python bench_parse_logs.py 10000 10000000 --output report.json
+# To keep the waypoints on every step, like the old logs,
+#   python bench_parse_logs.py --waypoints every_step
+
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+SAMPLE_FILENAME = 'truncated_simulation_log.txt'
+REPORT_FILENAME = 'bench_parse_logs.json'
+SIZES = [10000, 100000, 1000000]                # Steps in each synthetic log. 10M steps is a ~10 GB log.
+FRAMES = 200                                    # Frames drawn to measure the frames per second.
+STATUS_MARKER = b' TRACE_STATUS '
+WAYPOINTS_MARKER = b' TRACE_WAYPOINTS '
+STEPS_TOKEN = 8                                 # Position of steps in a TRACE_STATUS line, after the TRACE_STATUS.
+
+
+# Return the parm lines of a log, but with only the TRACE_WAYPOINTS lines that follow the first status of an episode.
+# A new episode starts when the steps counter goes back to the start, the same as reward_function.TrackTrace says.
+def waypoints_per_episode(lines):
+    output = []
+    last_steps = None
+    new_episode = True
+    for line in lines:
+        if STATUS_MARKER in line:
+            steps = float(line.split(STATUS_MARKER)[1].split()[STEPS_TOKEN])
+            new_episode = last_steps is None or (steps <= last_steps and steps <= 1)
+            last_steps = steps
+        elif WAYPOINTS_MARKER in line:
+            if not new_episode:
+                continue
+            new_episode = False
+        output.append(line)
+    return output
+
+
+# Write a log of parm steps TRACE_STATUS lines to parm filename, by repeating the lines of parm sample log. Parm
+# waypoints_mode is 'per_episode' or 'every_step', see the top of this file. Returns the number of bytes written.
+def write_synthetic_log(filename, steps, sample_filename=SAMPLE_FILENAME, waypoints_mode='per_episode'):
+    with open(sample_filename, 'rb') as fileobj:
+        sample = fileobj.read()
+    if not sample.endswith(b'\n'):
+        sample += b'\n'
+    lines = sample.splitlines(keepends=True)
+    if waypoints_mode == 'per_episode':
+        lines = waypoints_per_episode(lines)
+        sample = b''.join(lines)
+    sample_steps = sum(1 for line in lines if STATUS_MARKER in line)
+
+    written = 0
+    with open(filename, 'wb') as fileobj:
+        for _ in range(steps // sample_steps):
+            fileobj.write(sample)
+            written += len(sample)
+
+        # Part of the sample, to make up the rest of the steps.
+        remaining = steps % sample_steps
+        for line in lines:
+            if STATUS_MARKER in line:
+                if remaining == 0:
+                    break                       # Lines that go with the last status are kept, but no more.
+                remaining -= 1
+            fileobj.write(line)
+            written += len(line)
+    return written
+
+
+# Peak resident set size of this process so far, in bytes, or None where it can't be measured (the resource module is
+# Unix only, so not on Windows).
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak                             # Already in bytes on macOS.
+    return peak * 1024
+
+
+# Benchmark the log in parm filename. Run in a fresh process for each log, so that its peak memory is only for
+# that log. Returns a dictionary of results.
+def bench_log(filename):
+    import parse_logs as pl
+    import visualise_logs as vl
+
+    results = {'bytes': os.path.getsize(filename)}
+    with open(filename, 'rb') as fileobj:
+        results['lines'] = sum(chunk.count(b'\n') for chunk in iter(lambda: fileobj.read(1 << 20), b''))
+
+    start = time.perf_counter()
+    (_, statuses) = pl.filename_to_status_columns(filename)
+    elapsed = time.perf_counter() - start
+    results['statuses'] = len(statuses)
+    results['parse_seconds'] = elapsed
+    results['parse_mb_per_sec'] = results['bytes'] / elapsed / 1e6
+    results['parse_lines_per_sec'] = results['lines'] / elapsed
+    results['peak_rss_bytes'] = peak_rss()
+    del statuses
+
+    processes = os.cpu_count() or 1
+    start = time.perf_counter()
+    pl.filename_to_status_columns(filename, processes)
+    elapsed = time.perf_counter() - start
+    results['parallel_processes'] = processes
+    results['parallel_parse_mb_per_sec'] = results['bytes'] / elapsed / 1e6
+
+    track = vl.Track(filename, use_cache=False)
+    start = time.perf_counter()
+    track.find_min_max_dimensions()
+    results['find_min_max_seconds'] = time.perf_counter() - start
+
+    screen = vl.Visualise(track, headless=True)
+    frames = 0
+    start = time.perf_counter()
+    for s in itertools.islice(track.statuses, FRAMES):
+        screen.draw_all_elements(s)
+        frames += 1
+    results['frames_per_sec'] = frames / (time.perf_counter() - start)
+    vl.pygame.quit()
+    return results
+
+
+# Make a synthetic log of each of the parm sizes, in steps, and benchmark it. Returns the report, as a dictionary.
+def run_benchmark(sizes=SIZES, sample_filename=SAMPLE_FILENAME, waypoints_mode='per_episode'):
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'cpu_count': os.cpu_count(),
+              'waypoints_mode': waypoints_mode,
+              'results': []}
+
+    context = multiprocessing.get_context('spawn')             # Fresh process, so peak memory starts from nothing.
+    with tempfile.TemporaryDirectory() as directory:
+        for steps in sizes:
+            filename = os.path.join(directory, 'log_' + str(steps) + '.txt')
+            write_synthetic_log(filename, steps, sample_filename, waypoints_mode)
+            with context.Pool(1) as pool:
+                results = pool.apply(bench_log, (filename,))
+            os.remove(filename)
+            report['results'].append(dict(steps=steps, **results))
+    return report
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    options = {'--output': REPORT_FILENAME, '--waypoints': 'per_episode'}
+    for option in options:
+        if option in arguments:
+            position = arguments.index(option)
+            options[option] = arguments[position + 1]
+            del arguments[position:position + 2]
+    report_filename = options['--output']
+    sizes = [int(argument) for argument in arguments] or SIZES
+
+    benchmark = run_benchmark(sizes, waypoints_mode=options['--waypoints'])
+    with open(report_filename, 'w') as report_file:
+        json.dump(benchmark, report_file, indent=2)
+
+    for result in benchmark['results']:
+        peak = 'n/a' if result['peak_rss_bytes'] is None else result['peak_rss_bytes']
+        print('{steps:>10} steps {parse_mb_per_sec:8.1f} MB/s {parse_lines_per_sec:12.0f} lines/s '
+              '{peak:>12} peak RSS {find_min_max_seconds:8.4f} s min/max {frames_per_sec:7.1f} fps'
+              .format(peak=peak, **result))
+    print('Report written to', report_filename)
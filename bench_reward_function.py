@@ -0,0 +1,184 @@
+# Benchmark of the reward function, which runs once per step in the simulator's loop, so should be kept quick.
+# The reward function is called with params made from the statuses in truncated_simulation_log.txt, with each of the
+# trace formats, and the calls per second, latency, memory allocated and bytes sent to stdout are measured.
+#
+# To run the benchmark and compare it with the saved baseline,
+#   python bench_reward_function.py
+# To save the results as the new baseline,
+#   python bench_reward_function.py --save
+
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+import parse_logs as pl
+import replay
+import reward_function as rf
+
+LOG_FILENAME = 'truncated_simulation_log.txt'
+BASELINE_FILENAME = 'bench_reward_function.baseline.json'
+CALLS = 100000                          # Calls of the reward function timed for each trace format.
+LATENCY_CALLS = 20000                   # Calls timed one by one, for the latency percentiles.
+ALLOCATION_CALLS = 2000                 # Calls traced by tracemalloc, which is slow.
+TRACE_FORMATS = ['text', 'compact', 'off']
+SLOWER_THRESHOLD = 1.1                  # Ratio to the baseline that counts as a regression.
+
+# For each result, whether a bigger number is better.
+BIGGER_IS_BETTER = {'calls_per_sec': True,
+                    'p50_us': False,
+                    'p99_us': False,
+                    'alloc_bytes_per_call': False,
+                    'retained_blocks_per_call': False,
+                    'stdout_bytes_per_call': False}
+
+
+# Stands in for stdout, counting the bytes written to it rather than keeping them.
+class CountingWriter:
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode())
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+# Make a list of params dictionaries, like DeepRacer passes to the reward function, from the statuses in the parm log.
+def params_from_log(filename):
+    (waypoints, statuses) = pl.filename_to_status_columns(filename)
+    columns = {name: statuses.values(name) for name in replay.PARAMS_FIELDS}
+    return replay.make_params(columns, [[w['x'], w['y']] for w in waypoints])
+
+
+# Start the reward function afresh, with the parm trace format.
+def reset(trace_format):
+    rf.TRACE_FORMAT = trace_format
+    rf.track_trace = rf.TrackTrace()
+    rf.trace_writer = rf.TraceWriter()
+
+
+# Call the reward function parm calls times, going round and round the parm list of params.
+def call_many(all_params, calls):
+    reward_function = rf.reward_function
+    count = len(all_params)
+    for i in range(calls):
+        reward_function(all_params[i % count])
+
+
+# Benchmark the reward function with the parm trace format. Returns a dictionary of results, see BIGGER_IS_BETTER.
+def bench_trace_format(all_params, trace_format, calls=CALLS, latency_calls=LATENCY_CALLS,
+                       allocation_calls=ALLOCATION_CALLS):
+    results = {}
+    saved_format = rf.TRACE_FORMAT
+    writer = CountingWriter()
+    try:
+        with contextlib.redirect_stdout(writer):
+            # Warm up, so that the track geometry is already worked out.
+            reset(trace_format)
+            call_many(all_params, len(all_params))
+
+            reset(trace_format)
+            writer.bytes = 0
+            start = time.perf_counter()
+            call_many(all_params, calls)
+            rf.trace_writer.flush()
+            elapsed = time.perf_counter() - start
+            results['calls_per_sec'] = calls / elapsed
+            results['stdout_bytes_per_call'] = writer.bytes / calls
+
+            latencies = [0] * latency_calls
+            count = len(all_params)
+            clock = time.perf_counter_ns
+            reward_function = rf.reward_function
+            for i in range(latency_calls):
+                params = all_params[i % count]
+                start = clock()
+                reward_function(params)
+                latencies[i] = clock() - start
+            latencies.sort()
+            results['p50_us'] = latencies[latency_calls // 2] / 1000
+            results['p99_us'] = latencies[latency_calls * 99 // 100] / 1000
+
+            # Memory allocated while working out each reward, and memory still held onto afterwards.
+            blocks = sys.getallocatedblocks()
+            call_many(all_params, allocation_calls)
+            results['retained_blocks_per_call'] = max(sys.getallocatedblocks() - blocks, 0) / allocation_calls
+
+            allocated = 0
+            tracemalloc.start()
+            for i in range(allocation_calls):
+                params = all_params[i % count]
+                tracemalloc.reset_peak()
+                (current, _) = tracemalloc.get_traced_memory()
+                reward_function(params)
+                allocated += tracemalloc.get_traced_memory()[1] - current
+            tracemalloc.stop()
+            results['alloc_bytes_per_call'] = allocated / allocation_calls
+            rf.trace_writer.flush()
+    finally:
+        reset(saved_format)
+    return results
+
+
+# Run the benchmark for each trace format. Returns a dictionary of trace format -> results.
+def run_benchmark(filename=LOG_FILENAME, calls=CALLS, latency_calls=LATENCY_CALLS, allocation_calls=ALLOCATION_CALLS):
+    all_params = params_from_log(filename)
+    return {trace_format: bench_trace_format(all_params, trace_format, calls, latency_calls, allocation_calls)
+            for trace_format in TRACE_FORMATS}
+
+
+# Compare the parm results with the parm baseline results. Returns a list of (trace format, result name, baseline
+# value, value, ratio, regressed) tuples, where ratio is value / baseline value, and regressed is True if the value
+# is worse than the baseline by more than SLOWER_THRESHOLD.
+def compare(results, baseline):
+    output = []
+    for (trace_format, format_results) in results.items():
+        for (name, value) in format_results.items():
+            if name not in baseline.get(trace_format, {}):
+                continue
+            base_value = baseline[trace_format][name]
+            if base_value == 0:
+                ratio = 1.0 if value == 0 else float('inf')
+            else:
+                ratio = value / base_value
+            if BIGGER_IS_BETTER[name]:
+                regressed = ratio * SLOWER_THRESHOLD < 1.0
+            else:
+                regressed = ratio > SLOWER_THRESHOLD
+            output.append((trace_format, name, base_value, value, ratio, regressed))
+    return output
+
+
+def save_results(results, filename=BASELINE_FILENAME):
+    with open(filename, 'w') as fileobj:
+        json.dump(results, fileobj, indent=2, sort_keys=True)
+
+
+def load_results(filename=BASELINE_FILENAME):
+    with open(filename) as fileobj:
+        return json.load(fileobj)
+
+
+if __name__ == '__main__':
+    benchmark = run_benchmark()
+
+    for (trace_format, format_results) in benchmark.items():
+        print(trace_format)
+        for (result_name, result_value) in format_results.items():
+            print('  {:<26} {:>12.2f}'.format(result_name, result_value))
+
+    if '--save' in sys.argv:
+        save_results(benchmark)
+        print('Saved baseline to', BASELINE_FILENAME)
+    elif os.path.exists(BASELINE_FILENAME):
+        print('Compared with', BASELINE_FILENAME)
+        comparison = compare(benchmark, load_results())
+        for (trace_format, result_name, base_value, result_value, ratio, regressed) in comparison:
+            print('  {:<8} {:<26} {:>12.2f} {:>12.2f} {:>7.2f}x {}'.format(trace_format, result_name, base_value,
+                                                                           result_value, ratio,
+                                                                           'REGRESSED' if regressed else ''))
@@ -1,6 +1,7 @@
-# Functions for manipulating cartesian coordinates expressed as [x, y] lists.
+# Functions for manipulating cartesian coordinates expressed as [x, y] lists, or as numpy arrays of them.
 
 import math
+import numpy as np
 
 
 def translation(vertex, delta):
@@ -42,3 +43,47 @@ def rotate_around_a_point(vertex, pivot, rotation_degrees):
     re_moved_vertex = translation(rotated_vertex, pivot)                        # Step 3.
 
     return re_moved_vertex
+
+
+# Batch versions of the functions above, for numpy arrays of many coordinates at once. The coordinates are an array of
+# shape (..., N, 2), for N vertices of a 2d shape, or (K, N, 2) for K shapes each of N vertices, and so on.
+
+
+def rotation_matrix(rotation_degrees):
+    """Return the matrix that rotates row vectors by parm rotation in degrees, the same way as rotate_around_origin().
+    If parm rotation is an array of shape (...), one matrix is made for each rotation, giving shape (..., 2, 2)."""
+    rotation_radians = np.radians(rotation_degrees)
+    cos = np.cos(rotation_radians)
+    sin = np.sin(rotation_radians)
+    return np.stack([np.stack([cos, -sin], axis=-1),
+                     np.stack([sin, cos], axis=-1)], axis=-2)
+
+
+def per_shape(values):
+    """Make parm coordinates of shape (..., 2), one per shape, broadcast over the vertices of each shape."""
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim > 1:
+        return values[..., np.newaxis, :]
+    return values
+
+
+def batch_translation(vertices, delta):
+    """Move every vertex by parm delta, which is a coordinate, or an array of one coordinate per shape."""
+    return np.asarray(vertices, dtype=np.float64) + per_shape(delta)
+
+
+def batch_scale(vertices, scale_factor):
+    """Move every vertex closer / further from origin by parm scale factor."""
+    return np.asarray(vertices, dtype=np.float64) * scale_factor
+
+
+def batch_rotate_around_origin(vertices, rotation_degrees):
+    """Rotate every vertex around the origin by parm rotation in degrees, which may be an array of one rotation per
+    shape."""
+    return np.matmul(vertices, rotation_matrix(rotation_degrees))
+
+
+def batch_rotate_around_a_point(vertices, pivot, rotation_degrees):
+    """Rotate every vertex around parm pivot point by parm number of degrees. Both may be arrays of one per shape."""
+    pivot = per_shape(pivot)
+    return batch_rotate_around_origin(np.asarray(vertices, dtype=np.float64) - pivot, rotation_degrees) + pivot
@@ -0,0 +1,96 @@
+# An index of the episodes in a parse_logs.StatusColumns, so that any episode can be picked out without scanning
+# through all of the statuses before it.
+
+import numpy as np
+import parse_logs as pl
+
+# Fields of the summary rows made by EpisodeIndex.summary()
+SUMMARY_FIELDS = [('episode', 'int'),
+                  ('start', 'int'),
+                  ('length', 'int'),
+                  ('final_progress', 'float'),
+                  ('total_reward', 'float'),
+                  ('off_track_count', 'int')]
+
+RESET_MAX_STEPS = 1                     # Highest steps value that the counter is reset to at the start of an episode.
+
+
+class EpisodeIndex:
+
+    # statuses is the StatusColumns being indexed, starts is an array of the row number that each episode starts at,
+    # and numbers is an array of the episode number of each episode.
+    def __init__(self, statuses, starts, numbers):
+        self.statuses = statuses
+        self.starts = starts
+        self.ends = np.append(starts[1:], len(statuses)).astype(starts.dtype)
+        self.numbers = numbers
+        self.positions = {number: position for (position, number) in enumerate(numbers.tolist())}
+
+    # Build the index for the parm StatusColumns. If it has an 'episode' field (from SIM_TRACE_LOG lines) a new episode
+    # starts wherever the episode number changes. Otherwise, a new episode starts wherever the steps counter is reset
+    # back to the start. CloudWatch sometimes logs a few lines out of order, so the steps counter going down a little
+    # is not a reset.
+    @classmethod
+    def from_statuses(cls, statuses):
+        if len(statuses) == 0:
+            return cls(statuses, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+        steps = statuses.values('steps')
+        new_episode = (steps[1:] < steps[:-1]) & (steps[1:] <= RESET_MAX_STEPS)
+
+        names = [name for (name, _) in statuses.fields]
+        if 'episode' in names:
+            episode = statuses.values('episode')
+            known = (episode[1:] >= 0) & (episode[:-1] >= 0)            # -1 means not known, see join_sim_trace()
+            new_episode = np.where(known, episode[1:] != episode[:-1], new_episode)
+
+        starts = np.concatenate([[0], np.flatnonzero(new_episode) + 1]).astype(np.int64)
+
+        numbers = np.arange(len(starts), dtype=np.int64)
+        if 'episode' in names:
+            # Number each episode from the first status in it that has a known episode number, or failing that, one
+            # more than the episode before it.
+            episode = statuses.values('episode')
+            for (position, (start, end)) in enumerate(zip(starts, np.append(starts[1:], len(statuses)))):
+                known = np.flatnonzero(episode[start:end] >= 0)
+                if len(known) > 0:
+                    numbers[position] = episode[start + known[0]]
+                elif position > 0:
+                    numbers[position] = numbers[position - 1] + 1
+
+        return cls(statuses, starts, numbers)
+
+    def __len__(self):
+        return len(self.starts)
+
+    # Return a slice of the statuses for the parm episode number.
+    def slice(self, number):
+        position = self.positions[number]
+        return slice(int(self.starts[position]), int(self.ends[position]))
+
+    # Return the statuses of the parm episode number, as a StatusColumns.
+    def episode(self, number):
+        return self.statuses[self.slice(number)]
+
+    # Return a StatusColumns with one row per episode, see SUMMARY_FIELDS.
+    def summary(self):
+        if len(self) == 0:
+            columns = {name: np.zeros(0, dtype=np.float64 if kind == 'float' else np.int64)
+                       for (name, kind) in SUMMARY_FIELDS}
+            return pl.StatusColumns(SUMMARY_FIELDS, columns, np.zeros(0, dtype=np.uint16), {}, {})
+
+        # CloudWatch sometimes logs a few lines out of order, so the final step of an episode is the row with the most
+        # steps, which isn't always the last row. If there are several, it's the last of them.
+        steps = self.statuses.values('steps')
+        most_steps = np.repeat(np.maximum.reduceat(steps, self.starts), self.ends - self.starts)
+        final_rows = np.flatnonzero(steps == most_steps)
+        final_rows = final_rows[np.searchsorted(final_rows, self.ends) - 1]
+
+        off_track = (~self.statuses.values('all_wheels_on_track')).astype(np.int64)
+        columns = {'episode': self.numbers,
+                   'start': self.starts,
+                   'length': self.ends - self.starts,
+                   'final_progress': self.statuses.values('progress')[final_rows],
+                   'total_reward': np.add.reduceat(self.statuses.values('score'), self.starts),
+                   'off_track_count': np.add.reduceat(off_track, self.starts)}
+        return pl.StatusColumns(SUMMARY_FIELDS, columns, np.zeros(len(self), dtype=np.uint16), {}, {})
@@ -0,0 +1,135 @@
+# A cache of parsed logs, so that a big log file only needs to be parsed once.
+# The statuses and waypoints are saved next to the log file, as <log filename>.parsed.npz
+# The cache is only used while it is fresh, which is checked by comparing the size, modification time and a hash of
+# the contents of the log file with those that were saved along with the cache.
+
+import hashlib
+import os
+import zipfile
+import numpy as np
+import parse_logs as pl
+
+CACHE_SUFFIX = '.parsed.npz'
+CACHE_VERSION = 2                           # Bump this whenever the layout of the cache file changes.
+HASH_BLOCK_SIZE = 1 << 20                   # Bytes hashed at each sample point of the log file.
+
+# What reading a missing, empty, truncated or otherwise corrupt cache file raises. Such a cache is treated as stale.
+BAD_CACHE_ERRORS = (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile)
+
+
+def cache_filename(filename):
+    """Return the name of the cache file for a parm log filename."""
+    return filename + CACHE_SUFFIX
+
+
+def content_hash(filename):
+    """Hash of the contents of a parm log file.
+    Small files are hashed in full. For big files, only the first, middle and last blocks are hashed, so that checking
+    the cache of a multi-GB log stays quick. Together with the size and modification time this is enough to notice
+    the log file being replaced or appended to."""
+    size = os.path.getsize(filename)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as fileobj:
+        if size <= 3 * HASH_BLOCK_SIZE:
+            digest.update(fileobj.read())
+        else:
+            for offset in [0, (size - HASH_BLOCK_SIZE) // 2, size - HASH_BLOCK_SIZE]:
+                fileobj.seek(offset)
+                digest.update(fileobj.read(HASH_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def source_fingerprint(filename):
+    """Return a (size, modification time in ns, content hash) tuple for a parm log filename."""
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns, content_hash(filename)
+
+
+def save(filename, waypoints, statuses, fingerprint=None):
+    """Save parm waypoints and StatusColumns to the cache file for parm log filename.
+    The parm fingerprint is the source_fingerprint() of the log file from before it was parsed, so that a log that was
+    appended to while it was being parsed is not saved as fresh. If None, it is taken now.
+    Returns False if the cache file could not be written, for example because the directory is read only."""
+    (size, mtime_ns, digest) = source_fingerprint(filename) if fingerprint is None else fingerprint
+
+    arrays = {'version': np.array(CACHE_VERSION),
+              'source_size': np.array(size),
+              'source_mtime_ns': np.array(mtime_ns),
+              'source_hash': np.array(digest),
+              'fields': np.array([name + ':' + kind for (name, kind) in statuses.fields]),
+              'flags': statuses.flags,
+              'waypoint_numbers': np.array([w['waypoint'] for w in waypoints], dtype=np.int32),
+              'waypoint_xy': np.array([[w['x'], w['y']] for w in waypoints], dtype=np.float64).reshape(-1, 2)}
+    for (name, column) in statuses.columns.items():
+        arrays['column_' + name] = column
+    for (name, codes) in statuses.codes.items():
+        arrays['codes_' + name] = codes
+        arrays['lookup_' + name] = np.array(statuses.lookups[name], dtype=str)
+
+    # Write to a temporary file first, so that a half written cache is never picked up.
+    temp_filename = cache_filename(filename) + '.tmp'
+    try:
+        with open(temp_filename, 'wb') as fileobj:
+            np.savez(fileobj, **arrays)
+        os.replace(temp_filename, cache_filename(filename))
+    except OSError:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        return False
+    return True
+
+
+def load(filename):
+    """Load the cached (waypoints, StatusColumns) tuple for a parm log filename.
+    Returns None if there is no cache, or if the cache is stale or can't be read."""
+    try:
+        cache = np.load(cache_filename(filename), allow_pickle=False)
+        with cache:
+            return cached_status_columns(filename, cache)
+    except BAD_CACHE_ERRORS:
+        return None
+
+
+def cached_status_columns(filename, cache):
+    """Return the (waypoints, StatusColumns) tuple in parm cache, an opened cache file, for parm log filename.
+    Returns None if the cache is stale."""
+    if int(cache['version']) != CACHE_VERSION:
+        return None
+
+    # Size and modification time are cheap, so check those before hashing the log file.
+    stat = os.stat(filename)
+    if int(cache['source_size']) != stat.st_size or int(cache['source_mtime_ns']) != stat.st_mtime_ns:
+        return None
+    if str(cache['source_hash']) != content_hash(filename):
+        return None
+
+    fields = [tuple(field.split(':')) for field in cache['fields'].tolist()]
+    columns = {}
+    codes = {}
+    lookups = {}
+    for (name, kind) in fields:
+        if kind == 'text':
+            codes[name] = cache['codes_' + name]
+            lookups[name] = cache['lookup_' + name].tolist()
+        elif kind != 'bool':
+            columns[name] = cache['column_' + name]
+
+    waypoints = []
+    for (number, [x, y]) in zip(cache['waypoint_numbers'].tolist(), cache['waypoint_xy'].tolist()):
+        waypoints.append({'waypoint': number, 'x': x, 'y': y})
+
+    return waypoints, pl.StatusColumns(fields, columns, cache['flags'], codes, lookups)
+
+
+def load_status_columns(filename, processes=1):
+    """Return a (waypoints, StatusColumns) tuple for a parm log filename.
+    Loaded from the cache if it is fresh, otherwise the log file is parsed, by parm number of processes, and the cache
+    is (re)written."""
+    cached = load(filename)
+    if cached is not None:
+        return cached
+
+    fingerprint = source_fingerprint(filename)
+    waypoints, statuses = pl.filename_to_status_columns(filename, processes)
+    save(filename, waypoints, statuses, fingerprint)
+    return waypoints, statuses
@@ -1,3 +1,58 @@
+import array
+import bz2
+import gzip
+import io
+import mmap
+import multiprocessing
+import os
+import numpy as np
+import reward_function as rf
+
+try:
+    import zstandard                    # Optional, only needed for reading .zst logs.
+except ImportError:
+    zstandard = None
+
+# The first few bytes of each kind of compressed file that can be read.
+COMPRESSION_MAGIC = {'gzip': b'\x1f\x8b',
+                     'bz2': b'BZh',
+                     'zstd': b'\x28\xb5\x2f\xfd'}
+
+READ_BUFFER_SIZE = 4 << 20              # Bytes decompressed at a time when reading compressed logs.
+
+# The kinds of line that statuses and waypoints are parsed from. The reward function writes each status either as a
+# TRACE_STATUS line, or as a TRACE_COMPACT line whose rule is described by an earlier TRACE_RULE line.
+STATUS_RECORD_TYPES = ('TRACE_STATUS', 'TRACE_WAYPOINTS', 'TRACE_COMPACT', 'TRACE_RULE')
+
+
+# Return the kind of compression of the parm filename ('gzip', 'bz2' or 'zstd') or None if it is not compressed.
+def compression_of(filename):
+    with open(filename, 'rb') as fileobj:
+        start = fileobj.read(4)
+    for (compression, magic) in COMPRESSION_MAGIC.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+# Open the parm filename for reading bytes, decompressing it on the fly if it is compressed.
+def open_binary(filename):
+    compression = compression_of(filename)
+    if compression == 'gzip':
+        return gzip.open(filename, 'rb')
+    if compression == 'bz2':
+        return bz2.open(filename, 'rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('The zstandard package is needed to read ' + filename)
+        # Logs compressed in parallel (eg. by pzstd) or joined together are made of several frames, so read all of them.
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True, read_across_frames=True)
+    return open(filename, 'rb')
+
+
+# Open the parm filename for reading text, decompressing it on the fly if it is compressed.
+def open_log(filename):
+    return io.TextIOWrapper(io.BufferedReader(open_binary(filename), READ_BUFFER_SIZE))
 
 
 # Open the parm filename. Read each line of the file, splitting each line into a list of strings delimited by space.
@@ -10,7 +65,7 @@
 # ---------------
 def filename_to_list_of_strings(filename):
     output = []
-    with open(filename) as fileobj:
+    with open_log(filename) as fileobj:
         for line in fileobj:
             output.append((line.replace('\n', '')).split(' '))
     return output
@@ -28,12 +83,12 @@ def filter_by_2nd_item(input_list, target):
     return output
 
 
-# Make a list of waypoints out of filtered list of waypoint strings.
-def make_list_of_waypoints(input_list):
+# Make a list of waypoints out of a single TRACE_WAYPOINTS line, already split into a list of strings.
+def make_waypoints(s):
     output = []
     pos = -1
 
-    for item in input_list[0]:                            # Every item in the list is same, so arbitrarily pick 1st one.
+    for item in s:
         pos += 1
 
         if pos >= 2:                                    # Ignore the first two items in the list,
@@ -52,43 +107,684 @@ def make_list_of_waypoints(input_list):
     return output
 
 
+# Make a list of waypoints out of filtered list of waypoint strings.
+def make_list_of_waypoints(input_list):
+    return make_waypoints(input_list[0])                # Every item in the list is same, so arbitrarily pick 1st one.
+
+
 # 'true' -> True, 'false' -> False
 def string_to_bool(s):
     return s == 'true'
 
 
+# Make a status dictionary out of a single TRACE_STATUS line, already split into a list of strings.
+def make_status(s):
+    status = {}
+    status['timestamp'] = float(s[2])
+    status['all_wheels_on_track'] = string_to_bool(s[3])
+    status['x'] = float(s[4])
+    status['y'] = float(s[5])
+    status['distance_from_center'] = float(s[6])
+    status['is_left_of_center'] = string_to_bool(s[7])
+    status['heading'] = float(s[8])
+    status['progress'] = float(s[9])
+    status['steps'] = int(s[10])
+    status['speed'] = float(s[11])
+    status['steering_angle'] = float(s[12])
+    status['track_width'] = float(s[13])
+    status['max_speed'] = float(s[14])
+    status['max_steer'] = float(s[15])
+    status['near_centre_of_track'] = string_to_bool(s[16])
+    status['quite_near_centre_of_track'] = string_to_bool(s[17])
+    status['heading_in_right_direction'] = string_to_bool(s[18])
+    status['turning_hard'] = string_to_bool(s[19])
+    status['going_straight'] = string_to_bool(s[20])
+    status['going_fast'] = string_to_bool(s[21])
+    status['going_slowly'] = string_to_bool(s[22])
+    status['correcting_course'] = string_to_bool(s[23])
+    status['rule_number'] = int(s[24])
+    status['rule_description'] = s[25].replace('_', ' ')
+    status['reward_level'] = s[26].replace('_', ' ')
+    status['score'] = float(s[27])
+    status['track_fingerprint'] = s[28] if len(s) > 28 else ''      # Older logs don't have this.
+    return status
+
+
 def make_list_of_statuses(input_list):
     output = []
 
     for s in input_list:
-        status = {}
-        status['timestamp'] = float(s[2])
-        status['all_wheels_on_track'] = string_to_bool(s[3])
-        status['x'] = float(s[4])
-        status['y'] = float(s[5])
-        status['distance_from_center'] = float(s[6])
-        status['is_left_of_center'] = string_to_bool(s[7])
-        status['heading'] = float(s[8])
-        status['progress'] = float(s[9])
-        status['steps'] = int(s[10])
-        status['speed'] = float(s[11])
-        status['steering_angle'] = float(s[12])
-        status['track_width'] = float(s[13])
-        status['max_speed'] = float(s[14])
-        status['max_steer'] = float(s[15])
-        status['near_centre_of_track'] = string_to_bool(s[16])
-        status['quite_near_centre_of_track'] = string_to_bool(s[17])
-        status['heading_in_right_direction'] = string_to_bool(s[18])
-        status['turning_hard'] = string_to_bool(s[19])
-        status['going_straight'] = string_to_bool(s[20])
-        status['going_fast'] = string_to_bool(s[21])
-        status['going_slowly'] = string_to_bool(s[22])
-        status['correcting_course'] = string_to_bool(s[23])
-        status['rule_number'] = int(s[24])
-        status['rule_description'] = s[25].replace('_', ' ')
-        status['reward_level'] = s[26].replace('_', ' ')
-        status['score'] = float(s[27])
-
-        output.append(status)
+        output.append(make_status(s))
 
     return output
+
+
+# The raw bytes at the start of the 2nd item of each kind of line that the parser is interested in.
+# They all contain RECORD_MARKER, which is what the scanner searches for.
+RECORD_PREFIXES = {'TRACE_STATUS': b'TRACE_STATUS ',
+                   'TRACE_COMPACT': b'TRACE_COMPACT ',
+                   'TRACE_RULE': b'TRACE_RULE ',
+                   'TRACE_WAYPOINTS': b'TRACE_WAYPOINTS ',
+                   'TRACE_PROFILE': b'TRACE_PROFILE ',
+                   'SIM_TRACE_LOG': b'SIM_TRACE_LOG:'}
+RECORD_MARKER = b'TRACE_'
+
+
+# Scan the raw bytes of a parm buffer (bytes or mmap) between parm start and end, which must be at the start of lines.
+# Yields a (record type, list of strings) tuple for each line of the parm record types. Most lines are split on
+# spaces, but SIM_TRACE_LOG lines are yielded as their comma separated values. The simulator writes the same waypoints
+# line after every status, so a waypoints line is only yielded when it differs from the previous one.
+# Lines are found by searching the raw bytes, so lines of other record types are never copied out of the buffer or
+# decoded, and repeats of the same waypoints line are recognised by comparing raw bytes, without being decoded or
+# split.
+# When a log is scanned in several buffers, pass the same parm seen dictionary to each, so that the last waypoints
+# line is remembered from one buffer to the next.
+def scan_buffer(buffer, record_types=STATUS_RECORD_TYPES, start=0, end=None, seen=None):
+    if end is None:
+        end = len(buffer)
+    if seen is None:
+        seen = {}
+    prefixes = [(RECORD_PREFIXES[record_type], record_type) for record_type in record_types]
+    find = buffer.find
+    position = start
+
+    while True:
+        marker = find(RECORD_MARKER, position, end)
+        if marker < 0:
+            break
+
+        line_start = max(buffer.rfind(b'\n', start, marker) + 1, start)
+        line_end = find(b'\n', marker, end)
+        if line_end < 0:
+            line_end = end
+        position = line_end + 1                                 # Carry on searching from the next line.
+
+        item_start = find(b' ', line_start, line_end) + 1       # Start of the 2nd item.
+        if item_start == 0:
+            continue
+
+        for (prefix, record_type) in prefixes:
+            if find(prefix, item_start, item_start + len(prefix)) == item_start:
+                break
+        else:
+            continue                                            # Not a record type that we want.
+
+        if record_type == 'TRACE_WAYPOINTS':
+            waypoints_start = item_start + len(prefix)          # Ignore the timestamp at start of line.
+            last_waypoints = seen.get('waypoints', b'')
+            if (line_end - waypoints_start == len(last_waypoints)
+                    and find(last_waypoints, waypoints_start, line_end) == waypoints_start):   # Compared in place.
+                continue
+            seen['waypoints'] = buffer[waypoints_start:line_end]
+
+        if record_type == 'SIM_TRACE_LOG':
+            yield record_type, buffer[item_start + len(prefix):line_end].decode().rstrip('\r').split(',')
+        else:
+            yield record_type, buffer[line_start:line_end].decode().rstrip('\r').split(' ')
+
+
+# As scan_buffer(), for all of the lines read from the parm binary stream. The stream is read in big blocks, and each
+# block (up to its last newline) is scanned in one go, rather than reading it a line at a time.
+def scan_stream(stream, record_types=STATUS_RECORD_TYPES, buffer_size=READ_BUFFER_SIZE):
+    seen = {}
+    carried = b''                                               # Part of a line left over from the last block.
+
+    while True:
+        block = stream.read(buffer_size)
+        if not block:
+            break
+        block = carried + block
+        end = block.rfind(b'\n') + 1
+        carried = block[end:]
+        yield from scan_buffer(block, record_types, 0, end, seen)
+
+    if carried:
+        yield from scan_buffer(carried, record_types, seen=seen)
+
+
+# As scan_buffer(), for all of the lines in the parm filename. Plain log files are memory mapped rather than read,
+# compressed log files are decompressed as they are scanned.
+def scan_log(filename, record_types=STATUS_RECORD_TYPES):
+    if compression_of(filename) is not None:
+        with open_binary(filename) as stream:
+            yield from scan_stream(stream, record_types)
+        return
+
+    with open(filename, 'rb') as fileobj:
+        if os.fstat(fileobj.fileno()).st_size == 0:     # Empty files can't be memory mapped.
+            return
+        with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield from scan_buffer(buffer, record_types)
+
+
+# Turn a TRACE_COMPACT line, already split into a list of strings, into the list of strings of the TRACE_STATUS line
+# that it stands for. parm rules is a dictionary of rule number -> (reward level, description), from TRACE_RULE lines.
+#
+# Eg. input,
+# ['2019-05-18T13:37:43.440Z', 'TRACE_COMPACT', '1558186663.38702', '5.32', ... '1', '0', '0.1', '1f2e3d4c']
+def compact_to_status_strings(s, rules):
+    flags = int(s[14])
+    bools = ['true' if flags & (1 << bit) else 'false' for bit in range(10)]
+    (reward_level, description) = rules.get(s[15], ('Unknown', 'Rule_' + s[15]))
+
+    return ([s[0], 'TRACE_STATUS', s[2], bools[0]]
+            + s[3:6]                                    # x, y, distance_from_center
+            + [bools[1]]
+            + s[6:14]                                   # heading ... max_steer
+            + bools[2:]
+            + [s[15], description, reward_level]
+            + s[16:])                                   # score, track_fingerprint
+
+
+# Go through the (record type, list of strings) tuples made by one of the scan functions, turning TRACE_COMPACT lines
+# into TRACE_STATUS lines, using the descriptions of the rules from TRACE_RULE lines. Other lines are passed through.
+def expand_compact(scanned, rules=None):
+    if rules is None:
+        rules = {}
+
+    for record_type, s in scanned:
+        if record_type == 'TRACE_COMPACT':
+            yield 'TRACE_STATUS', compact_to_status_strings(s, rules)
+        elif record_type == 'TRACE_RULE':
+            rules[s[2]] = (s[3], s[4])
+        else:
+            yield record_type, s
+
+
+# Return a dictionary of rule number -> (reward level, description) from all of the TRACE_RULE lines in the parm
+# filename. Only the raw bytes are searched, so this is much quicker than scanning the whole log.
+def read_rules(filename):
+    rules = {}
+    with open(filename, 'rb') as fileobj:
+        if os.fstat(fileobj.fileno()).st_size == 0:
+            return rules
+        with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            position = buffer.find(b' TRACE_RULE ')
+            while position >= 0:
+                line_end = buffer.find(b'\n', position)
+                if line_end < 0:
+                    line_end = len(buffer)
+                s = buffer[position + 1:line_end].decode().rstrip('\r').split(' ')
+                rules[s[1]] = (s[2], s[3])
+                position = buffer.find(b' TRACE_RULE ', line_end)
+    return rules
+
+
+# Read the parm filename in a single pass, yielding a (record type, record) tuple for each useful line.
+# TRACE_STATUS lines give a status dictionary, TRACE_WAYPOINTS lines give a list of waypoints.
+#
+# Eg. output,
+# ('TRACE_STATUS', {'timestamp': 1558186663.38702, ...})
+# ('TRACE_WAYPOINTS', [{'waypoint': 0, 'x': 5.20, 'y': 0.59}, ...])
+# ('TRACE_STATUS', {'timestamp': 1558186663.5074337, ...})
+def stream_log(filename):
+    for record_type, s in expand_compact(scan_log(filename)):
+        if record_type == 'TRACE_STATUS':
+            yield record_type, make_status(s)
+        else:
+            yield record_type, make_waypoints(s)
+
+
+# Return the fingerprint of the track of a TRACE_WAYPOINTS line, already split into a list of strings.
+# It is the same as the track_fingerprint field of the TRACE_STATUS lines that go with those waypoints.
+def waypoints_fingerprint(s):
+    return rf.track_fingerprint(' '.join(s[2:]))
+
+
+# Return a dictionary of track fingerprint -> list of waypoints, for every different set of waypoints in the parm
+# filename. The reward function may only write the waypoints once per episode, or when they change, so use this to
+# find the waypoints that go with each status.
+def read_all_waypoints(filename):
+    output = {}
+    for record_type, s in scan_log(filename, ('TRACE_WAYPOINTS',)):
+        fingerprint = waypoints_fingerprint(s)
+        if fingerprint not in output:
+            output[fingerprint] = make_waypoints(s)
+    return output
+
+
+# Return the first list of waypoints in the parm filename, or an empty list if there are none.
+def read_waypoints(filename):
+    for record_type, record in stream_log(filename):
+        if record_type == 'TRACE_WAYPOINTS':
+            return record
+    return []
+
+
+# Make a profile dictionary from a TRACE_PROFILE line, already split into a list of strings. The reward function writes
+# these every reward_function.PROFILE_INTERVAL calls, and each one covers the calls since the one before it.
+#
+# Eg. input,
+# ['2019-05-18T13:37:43.440Z', 'TRACE_PROFILE', '1558186663.38702', '1000', 'update=412000:8/20,9/970,10/10', ...
+#  'rules=0/300,1/700']
+#
+# Eg. output,
+# {'timestamp': 1558186663.38702, 'calls': 1000,
+#  'phases': {'update': {'total_ns': 412000, 'histogram': {8: 20, 9: 970, 10: 10}}, ...},
+#  'rules': {0: 300, 1: 700}}
+def make_profile(s):
+    profile = {'timestamp': float(s[2]), 'calls': int(s[3]), 'phases': {}, 'rules': {}}
+    for item in s[4:]:
+        (name, value) = item.split('=', 1)
+        if name == 'rules':
+            profile['rules'] = {int(number): int(count) for (number, count) in
+                                (pair.split('/') for pair in value.split(',') if pair)}
+        else:
+            (total, buckets) = value.split(':', 1)
+            histogram = {int(bucket): int(count) for (bucket, count) in
+                         (pair.split('/') for pair in buckets.split(',') if pair)}
+            profile['phases'][name] = {'total_ns': int(total), 'histogram': histogram}
+    return profile
+
+
+# Return a list of the profiles, see make_profile(), from every TRACE_PROFILE line in the parm filename.
+def read_profiles(filename):
+    return [make_profile(s) for (_, s) in scan_log(filename, ('TRACE_PROFILE',))]
+
+
+# Add up a parm list of profiles into a single profile, covering all of their calls. Its timestamp is the last one's.
+def sum_profiles(profiles):
+    total = {'timestamp': 0.0, 'calls': 0, 'phases': {}, 'rules': {}}
+    for profile in profiles:
+        total['timestamp'] = profile['timestamp']
+        total['calls'] += profile['calls']
+        for (name, phase) in profile['phases'].items():
+            total_phase = total['phases'].setdefault(name, {'total_ns': 0, 'histogram': {}})
+            total_phase['total_ns'] += phase['total_ns']
+            for (bucket, count) in phase['histogram'].items():
+                total_phase['histogram'][bucket] = total_phase['histogram'].get(bucket, 0) + count
+        for (number, count) in profile['rules'].items():
+            total['rules'][number] = total['rules'].get(number, 0) + count
+    return total
+
+
+# A re-iterable sequence of the statuses in a log file. Rather than being held in memory, the statuses are parsed
+# afresh from the file each time they are iterated over, so memory use stays flat however big the log is.
+class StatusStream:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.length = None                              # Counted the first time that it is needed.
+
+    def __iter__(self):
+        for record_type, record in stream_log(self.filename):
+            if record_type == 'TRACE_STATUS':
+                yield record
+
+    def __len__(self):
+        if self.length is None:
+            self.length = 0
+            for _ in self:
+                self.length += 1
+        return self.length
+
+
+# The fields of a TRACE_STATUS line, in the order that they appear after the timestamp and record type.
+# Each field is stored in one of three ways by StatusColumns,
+# 'float', 'int'    - A numpy array of that type.
+# 'bool'            - A bit in the packed flags array.
+# 'text'            - A small integer code into a lookup table of distinct strings.
+STATUS_FIELDS = [('timestamp', 'float'),
+                 ('all_wheels_on_track', 'bool'),
+                 ('x', 'float'),
+                 ('y', 'float'),
+                 ('distance_from_center', 'float'),
+                 ('is_left_of_center', 'bool'),
+                 ('heading', 'float'),
+                 ('progress', 'float'),
+                 ('steps', 'int'),
+                 ('speed', 'float'),
+                 ('steering_angle', 'float'),
+                 ('track_width', 'float'),
+                 ('max_speed', 'float'),
+                 ('max_steer', 'float'),
+                 ('near_centre_of_track', 'bool'),
+                 ('quite_near_centre_of_track', 'bool'),
+                 ('heading_in_right_direction', 'bool'),
+                 ('turning_hard', 'bool'),
+                 ('going_straight', 'bool'),
+                 ('going_fast', 'bool'),
+                 ('going_slowly', 'bool'),
+                 ('correcting_course', 'bool'),
+                 ('rule_number', 'int'),
+                 ('rule_description', 'text'),
+                 ('reward_level', 'text'),
+                 ('score', 'float'),
+                 ('track_fingerprint', 'text')]
+
+
+# Statuses stored as columns, one typed numpy array per field, rather than as a list of dictionaries.
+# Indexing with an integer gives a status dictionary, the same as make_status() makes, so a StatusColumns can be used
+# anywhere that a list of statuses is expected. Indexing with a slice gives another StatusColumns.
+class StatusColumns:
+
+    # fields is a list of (field name, kind) tuples, like STATUS_FIELDS.
+    # columns is a dictionary of field name -> numpy array, for 'float' and 'int' fields.
+    # flags is an array of bit masks, bit n is the value of the nth 'bool' field.
+    # codes is a dictionary of field name -> numpy array of codes, and lookups is a dictionary of field name -> list
+    # of strings, for 'text' fields.
+    def __init__(self, fields, columns, flags, codes, lookups):
+        self.fields = fields
+        self.columns = columns
+        self.flags = flags
+        self.codes = codes
+        self.lookups = lookups
+        self.flag_names = [name for (name, kind) in fields if kind == 'bool']
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('status index out of range')
+        return self.row(index)
+
+    # Make a status dictionary for the parm row number.
+    def row(self, index):
+        status = {}
+        flags = int(self.flags[index])
+        bit = 0
+        for (name, kind) in self.fields:
+            if kind == 'bool':
+                status[name] = bool(flags & (1 << bit))
+                bit += 1
+            elif kind == 'text':
+                status[name] = self.lookups[name][self.codes[name][index]]
+            else:
+                status[name] = self.columns[name][index].item()
+        return status
+
+    # Make a new StatusColumns out of the rows picked by the parm index, which may be a slice, an array of row numbers
+    # or a boolean mask.
+    def take(self, index):
+        return StatusColumns(self.fields,
+                             {name: column[index] for (name, column) in self.columns.items()},
+                             self.flags[index],
+                             {name: codes[index] for (name, codes) in self.codes.items()},
+                             self.lookups)
+
+    # Return all of the values of the parm field as an array. 'bool' fields give a boolean array, 'text' fields give
+    # an array of strings.
+    def values(self, name):
+        if name in self.columns:
+            return self.columns[name]
+        if name in self.codes:
+            return np.array(self.lookups[name], dtype=object)[self.codes[name]]
+        return (self.flags & (1 << self.flag_names.index(name))) != 0
+
+
+# Builds a StatusColumns one TRACE_STATUS line at a time, holding the values in compact arrays as it goes.
+class StatusColumnsBuilder:
+
+    def __init__(self):
+        self.floats = {}
+        self.ints = {}
+        self.texts = {}
+        for (name, kind) in STATUS_FIELDS:
+            if kind == 'float':
+                self.floats[name] = array.array('d')
+            elif kind == 'int':
+                self.ints[name] = array.array('l')
+            elif kind == 'text':
+                self.texts[name] = (array.array('H'), {})     # Codes, and text -> code lookup.
+        self.flags = array.array('H')
+
+    # Add a TRACE_STATUS line, already split into a list of strings.
+    def add(self, s):
+        flags = 0
+        bit = 0
+        for (position, (name, kind)) in enumerate(STATUS_FIELDS, start=2):
+            item = s[position] if position < len(s) else ''         # Older logs have fewer fields.
+            if kind == 'float':
+                self.floats[name].append(float(item))
+            elif kind == 'bool':
+                if item == 'true':
+                    flags |= 1 << bit
+                bit += 1
+            elif kind == 'int':
+                self.ints[name].append(int(item))
+            else:
+                codes, lookup = self.texts[name]
+                code = lookup.get(item)
+                if code is None:
+                    code = len(lookup)
+                    lookup[item] = code
+                codes.append(code)
+        self.flags.append(flags)
+
+    def build(self):
+        columns = {}
+        for (name, values) in self.floats.items():
+            columns[name] = np.array(values, dtype=np.float64)
+        for (name, values) in self.ints.items():
+            columns[name] = np.array(values, dtype=np.int32)
+
+        codes = {}
+        lookups = {}
+        for (name, (values, lookup)) in self.texts.items():
+            codes[name] = np.array(values, dtype=np.uint16)
+            lookups[name] = [text.replace('_', ' ') for text in lookup]
+
+        return StatusColumns(STATUS_FIELDS, columns, np.array(self.flags, dtype=np.uint16), codes, lookups)
+
+
+# Parse the (record type, list of strings) tuples that scan_buffer() yields, returning a tuple of the first list of
+# waypoints and a StatusColumns of all of the statuses. parm rules is passed on to expand_compact().
+def scanned_to_status_columns(scanned, rules=None):
+    waypoints = []
+    builder = StatusColumnsBuilder()
+
+    for record_type, s in expand_compact(scanned, rules):
+        if record_type == 'TRACE_STATUS':
+            builder.add(s)
+        elif not waypoints:
+            waypoints = make_waypoints(s)
+
+    return waypoints, builder.build()
+
+
+# Join a list of StatusColumns end to end. Each one has its own lookup tables, so the codes of 'text' fields are
+# translated into the lookup tables of the joined StatusColumns.
+def concatenate_status_columns(parts):
+    first = parts[0]
+    columns = {name: np.concatenate([part.columns[name] for part in parts]) for name in first.columns}
+    flags = np.concatenate([part.flags for part in parts])
+
+    codes = {}
+    lookups = {}
+    for name in first.codes:
+        lookup = []
+        index = {}
+        translated = []
+        for part in parts:
+            translation = []
+            for text in part.lookups[name]:
+                if text not in index:
+                    index[text] = len(lookup)
+                    lookup.append(text)
+                translation.append(index[text])
+            translated.append(np.array(translation, dtype=np.uint16)[part.codes[name]])
+        codes[name] = np.concatenate(translated)
+        lookups[name] = lookup
+
+    return StatusColumns(first.fields, columns, flags, codes, lookups)
+
+
+# Split the parm filename into about parm chunks (start, end) byte ranges. Each range starts at the beginning of a line
+# and ends just after a newline (or at the end of the file), so no line is split between two ranges.
+def newline_aligned_ranges(filename, chunks):
+    size = os.path.getsize(filename)
+    boundaries = [0]
+
+    with open(filename, 'rb') as fileobj:
+        for chunk in range(1, chunks):
+            position = chunk * size // chunks
+            if position <= boundaries[-1]:
+                continue
+            fileobj.seek(position - 1)
+            fileobj.readline()                          # Move on to the start of the next line.
+            if boundaries[-1] < fileobj.tell() < size:
+                boundaries.append(fileobj.tell())
+
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+# Parse a single (filename, start, end, rules) byte range. Run in the worker processes of filename_to_status_columns().
+def parse_byte_range(byte_range):
+    (filename, start, end, rules) = byte_range
+    with open(filename, 'rb') as fileobj:
+        with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return scanned_to_status_columns(scan_buffer(buffer, start=start, end=end), dict(rules))
+
+
+# Parse the parm filename, returning a tuple of its first list of waypoints and a StatusColumns of all of its statuses.
+# If parm processes is more than 1, the file is split into newline aligned byte ranges, which are parsed by a pool of
+# that many processes, and then joined back together in order. None means one process per CPU. Compressed logs can't
+# be split up like that, and empty ones can't be memory mapped, so are always parsed by a single process.
+def filename_to_status_columns(filename, processes=1):
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if processes <= 1 or compression_of(filename) is not None or os.path.getsize(filename) == 0:
+        return scanned_to_status_columns(scan_log(filename))
+
+    # A TRACE_RULE line may be in a different byte range to the TRACE_COMPACT lines that use it, so find them first.
+    rules = read_rules(filename)
+    ranges = newline_aligned_ranges(filename, 4 * processes)    # More chunks than processes, to balance the load.
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(parse_byte_range, [(filename, start, end, rules) for (start, end) in ranges])
+
+    waypoints = []
+    for (chunk_waypoints, _) in results:
+        if chunk_waypoints:
+            waypoints = chunk_waypoints
+            break
+
+    return waypoints, concatenate_status_columns([statuses for (_, statuses) in results])
+
+
+# The comma separated values of a SIM_TRACE_LOG line, which the DeepRacer simulator writes after every step whether or
+# not the reward function writes TRACE_STATUS lines. Fields which are also in TRACE_STATUS lines have the same names.
+SIM_TRACE_FIELDS = [('episode', 'int'),
+                    ('steps', 'int'),
+                    ('x', 'float'),
+                    ('y', 'float'),
+                    ('heading', 'float'),                       # Radians in the log, degrees once parsed.
+                    ('steering_angle', 'float'),                # Radians in the log, degrees once parsed.
+                    ('speed', 'float'),
+                    ('action', 'int'),
+                    ('score', 'float'),
+                    ('done', 'bool'),
+                    ('all_wheels_on_track', 'bool'),
+                    ('progress', 'float'),
+                    ('closest_waypoint', 'int'),
+                    ('track_length', 'float'),
+                    ('timestamp', 'float')]
+
+SIM_TRACE_ROWS_PER_BATCH = 100000
+
+
+# Make a StatusColumns out of a list of SIM_TRACE_LOG lines, each already split into its comma separated values.
+# The conversion is done a whole column at a time.
+def make_sim_trace_columns(rows):
+    table = np.array(rows, dtype=str).reshape(len(rows), len(SIM_TRACE_FIELDS))
+    columns = {}
+    flags = np.zeros(len(rows), dtype=np.uint16)
+    bit = 0
+
+    for (position, (name, kind)) in enumerate(SIM_TRACE_FIELDS):
+        if kind == 'float':
+            columns[name] = table[:, position].astype(np.float64)
+        elif kind == 'int':
+            columns[name] = table[:, position].astype(np.int32)
+        else:
+            flags |= (table[:, position] == 'True').astype(np.uint16) << bit
+            bit += 1
+
+    columns['heading'] = np.degrees(columns['heading'])
+    columns['steering_angle'] = np.degrees(columns['steering_angle'])
+
+    return StatusColumns(SIM_TRACE_FIELDS, columns, flags, {}, {})
+
+
+# Parse all of the SIM_TRACE_LOG lines in the parm filename into a StatusColumns. Lines without the right number of
+# values, such as a line cut short at the end of a log, or a line from a newer simulator with more values, are skipped.
+def filename_to_sim_trace_columns(filename):
+    parts = []
+    rows = []
+    for (_, row) in scan_log(filename, ('SIM_TRACE_LOG',)):
+        if len(row) != len(SIM_TRACE_FIELDS):
+            continue
+        rows.append(row)
+        if len(rows) == SIM_TRACE_ROWS_PER_BATCH:             # Convert in batches, to keep memory use down.
+            parts.append(make_sim_trace_columns(rows))
+            rows = []
+    if rows or not parts:
+        parts.append(make_sim_trace_columns(rows))
+
+    return concatenate_status_columns(parts)
+
+
+# For each status in the parm StatusColumns, find the SIM_TRACE_LOG row for the same step. The simulator writes it just
+# after the reward function writes the status, so it is the row with the same steps value that has the nearest
+# timestamp, as long as that is within parm tolerance seconds. Returns an array of row numbers in the parm sim trace
+# StatusColumns, which is -1 for statuses that have no matching row.
+def match_sim_trace(statuses, sim_trace, tolerance=0.5):
+    matches = np.full(len(statuses), -1, dtype=np.int64)
+    if len(sim_trace) == 0:
+        return matches
+
+    status_times = statuses.values('timestamp')
+    sim_times = sim_trace.values('timestamp')
+    order = np.argsort(sim_times, kind='stable')
+
+    # The nearest timestamps are either side of where each status would be inserted into the sorted sim trace.
+    after = np.clip(np.searchsorted(sim_times[order], status_times), 0, len(order) - 1)
+    before = np.clip(after - 1, 0, None)
+
+    best_gap = np.full(len(statuses), np.inf)
+    for candidate in [order[before], order[after]]:
+        gap = np.abs(sim_times[candidate] - status_times)
+        same_step = sim_trace.values('steps')[candidate] == statuses.values('steps')
+        better = (gap < best_gap) & (gap <= tolerance) & same_step
+        matches[better] = candidate[better]
+        best_gap[better] = gap[better]
+
+    return matches
+
+
+# Join the parm sim trace on to the parm statuses, giving a StatusColumns which has all of the TRACE_STATUS fields plus
+# the SIM_TRACE_LOG fields that are not in the TRACE_STATUS line. Statuses without a matching sim trace row get -1 for
+# int fields, NaN for float fields and False for bool fields.
+def join_sim_trace(statuses, sim_trace, tolerance=0.5):
+    matches = match_sim_trace(statuses, sim_trace, tolerance)
+    matched = matches >= 0
+    status_names = [name for (name, _) in statuses.fields]
+    extra_fields = [(name, kind) for (name, kind) in sim_trace.fields if name not in status_names]
+
+    columns = dict(statuses.columns)
+    flags = statuses.flags.astype(np.uint32)
+    bit = len(statuses.flag_names)
+    for (name, kind) in extra_fields:
+        values = sim_trace.values(name)[np.where(matched, matches, 0)] if len(sim_trace) else None
+        if kind == 'bool':
+            if values is not None:
+                flags |= (values & matched).astype(np.uint32) << bit
+            bit += 1
+        else:
+            missing = -1 if kind == 'int' else np.nan
+            column = np.full(len(statuses), missing, dtype=sim_trace.columns[name].dtype)
+            if values is not None:
+                column[matched] = values[matched]
+            columns[name] = column
+
+    return StatusColumns(statuses.fields + extra_fields, columns, flags, statuses.codes, statuses.lookups)
@@ -0,0 +1,198 @@
+# Replay a logged training run through one or more variants of the reward function, to see what each of them would
+# have given. A variant is the filename of a Python file with a reward_function(params) in it, like reward_function.py
+# The first variant is the baseline that the others are compared with.
+#
+# The params are rebuilt from the TRACE_STATUS lines of the log and the waypoints of the track. The logs don't say
+# which waypoints were closest to the car, so those are worked out from the car's position.
+#
+# To compare two variants on a log,
+#   python replay.py <log filename> reward_function.py <other reward function>.py
+
+import contextlib
+import importlib.util
+import multiprocessing
+import os
+import sys
+import numpy as np
+import batch_reward as br
+import episodes as ep
+import log_cache as lc
+import parse_logs as pl
+
+ROWS_PER_CHUNK = 100000                 # Rough number of steps that each worker scores at a time.
+NO_RULE = -1                            # Rule number for variants that don't say which rule was met.
+
+# Fields of the statuses that go into the params of the reward function.
+PARAMS_FIELDS = ['all_wheels_on_track', 'x', 'y', 'distance_from_center', 'is_left_of_center', 'heading', 'progress',
+                 'steps', 'speed', 'steering_angle', 'track_width']
+
+# Variants loaded so far by this process, filename -> module.
+loaded_variants = {}
+
+
+# Load the reward function variant in parm filename, as a module. Each variant is loaded once per process.
+# Trace output is turned off, if the variant has a TRACE_FORMAT setting, as it isn't wanted when replaying.
+def load_variant(filename):
+    if filename not in loaded_variants:
+        name = 'variant_' + str(len(loaded_variants))
+        spec = importlib.util.spec_from_file_location(name, filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if hasattr(module, 'TRACE_FORMAT'):
+            module.TRACE_FORMAT = 'off'
+        loaded_variants[filename] = module
+    return loaded_variants[filename]
+
+
+# Split the parm EpisodeIndex into (start, end) row ranges of about ROWS_PER_CHUNK rows each, only splitting between
+# episodes, so that each variant sees every episode from its start.
+def episode_chunks(index, rows_per_chunk=ROWS_PER_CHUNK):
+    chunks = []
+    start = 0
+    for end in index.ends.tolist():
+        if end - start >= rows_per_chunk:
+            chunks.append((start, end))
+            start = end
+    if len(index) > 0 and start < int(index.ends[-1]):
+        chunks.append((start, int(index.ends[-1])))
+    return chunks
+
+
+# Make the list of params dictionaries for parm batch of columns, which is a dictionary of field name -> array, plus
+# 'waypoints' (a list of the track's waypoints, each [x, y]). Rows of the same track share the same waypoints list,
+# which is what the reward function sees during training too.
+def make_params(columns, waypoints):
+    closest_waypoints = br.find_closest_waypoints(columns['x'], columns['y'], waypoints).tolist()
+    values = [columns[name].tolist() for name in PARAMS_FIELDS]
+    output = []
+    for (row, closest) in zip(zip(*values), closest_waypoints):
+        params = dict(zip(PARAMS_FIELDS, row))
+        params['waypoints'] = waypoints
+        params['closest_waypoints'] = closest
+        output.append(params)
+    return output
+
+
+# Score a chunk of steps with each variant. Run in the worker processes of replay().
+# The parm chunk is a tuple of (list of variant filenames, dictionary of columns, list of waypoints of each row's
+# track, array of which track each row is on). Returns a list of (scores array, rule numbers array), one per variant.
+def score_chunk(chunk):
+    (variants, columns, tracks, track_numbers) = chunk
+
+    all_params = [None] * len(track_numbers)
+    for (number, waypoints) in enumerate(tracks):
+        rows = np.flatnonzero(track_numbers == number)
+        if len(rows) > 0 and waypoints:
+            track_params = make_params({name: column[rows] for (name, column) in columns.items()}, waypoints)
+            for (row, params) in zip(rows.tolist(), track_params):
+                all_params[row] = params
+
+    output = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):      # Variants may print things.
+        for filename in variants:
+            module = load_variant(filename)
+            engine = getattr(module, 'engine', None)
+            scores = np.full(len(all_params), np.nan)
+            rules = np.full(len(all_params), NO_RULE, dtype=np.int64)
+            for (row, params) in enumerate(all_params):
+                if params is not None:                      # No waypoints for the track, so can't be scored.
+                    scores[row] = module.reward_function(params)
+                    if engine is not None:
+                        rules[row] = engine.reinforcement.rule_number
+            output.append((scores, rules))
+    return output
+
+
+# Replay the log in parm filename through each of the parm variants, in parm number of processes (None means one per
+# CPU), each scoring about parm rows_per_chunk steps at a time. Returns a dictionary of,
+#   'episodes'      - EpisodeIndex of the statuses of the log.
+#   'logged_scores' - Array of the scores in the log.
+#   'scores'        - Dictionary of variant filename -> array of scores, one per step.
+#   'rules'         - Dictionary of variant filename -> array of rule numbers, one per step.
+def replay(filename, variants, processes=None, rows_per_chunk=ROWS_PER_CHUNK):
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    (waypoints, statuses) = lc.load_status_columns(filename, processes)
+    index = ep.EpisodeIndex.from_statuses(statuses)
+
+    # Waypoints of each track in the log. Statuses without a fingerprint go with the first waypoints in the log.
+    all_waypoints = pl.read_all_waypoints(filename)
+    lookup = statuses.lookups['track_fingerprint']
+    tracks = []
+    for fingerprint in lookup:
+        track = all_waypoints.get(fingerprint, waypoints) if fingerprint else waypoints
+        tracks.append([[w['x'], w['y']] for w in track])
+
+    columns = {name: statuses.values(name) for name in PARAMS_FIELDS}
+    track_numbers = statuses.codes['track_fingerprint']
+    chunks = [(variants, {name: column[start:end] for (name, column) in columns.items()}, tracks,
+               track_numbers[start:end]) for (start, end) in episode_chunks(index, rows_per_chunk)]
+
+    if processes <= 1 or len(chunks) <= 1:
+        results = [score_chunk(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(score_chunk, chunks)
+
+    output = {'episodes': index, 'logged_scores': statuses.values('score'), 'scores': {}, 'rules': {}}
+    for (position, variant) in enumerate(variants):
+        parts = [result[position] for result in results]
+        output['scores'][variant] = np.concatenate([scores for (scores, _) in parts] or [np.zeros(0)])
+        output['rules'][variant] = np.concatenate([rules for (_, rules) in parts] or [np.zeros(0, dtype=np.int64)])
+    return output
+
+
+# Compare the variants of the parm result of replay() with the first one. Returns a dictionary of variant filename ->
+# dictionary of,
+#   'rule_counts'     - Dictionary of rule number -> number of steps that the rule was met.
+#   'total_score'     - Sum of the scores of every step.
+#   'unscored_steps'  - Number of steps that couldn't be scored, as there were no waypoints for their track.
+#   'changed_steps'   - Number of steps with a different score to the baseline.
+#   'mean_delta'      - Mean of score - baseline score, over every step.
+#   'max_delta'       - Biggest difference, either way, between score and baseline score.
+#   'episode_returns' - Array of the total score of each episode.
+#   'return_deltas'   - Array of episode return - baseline episode return, for each episode.
+# Unscored steps have a score of NaN, and are left out of everything but 'unscored_steps'.
+def compare(result):
+    starts = result['episodes'].starts
+    variants = list(result['scores'])
+    output = {}
+    for variant in variants:
+        scores = result['scores'][variant]
+        deltas = scores - result['scores'][variants[0]]
+        deltas = deltas[~np.isnan(deltas)]
+        (numbers, counts) = np.unique(result['rules'][variant], return_counts=True)
+        returns = np.add.reduceat(np.nan_to_num(scores), starts) if len(scores) > 0 else np.zeros(0)
+        output[variant] = {'rule_counts': dict(zip(numbers.tolist(), counts.tolist())),
+                           'total_score': float(np.nansum(scores)),
+                           'unscored_steps': int(np.count_nonzero(np.isnan(scores))),
+                           'changed_steps': int(np.count_nonzero(deltas)),
+                           'mean_delta': float(np.mean(deltas)) if len(deltas) > 0 else 0.0,
+                           'max_delta': float(np.max(np.abs(deltas))) if len(deltas) > 0 else 0.0,
+                           'episode_returns': returns}
+        output[variant]['return_deltas'] = returns - output[variants[0]]['episode_returns']
+    return output
+
+
+# Print the parm comparison, as made by compare(), of the parm result of replay().
+def print_comparison(result, comparison):
+    numbers = result['episodes'].numbers.tolist()
+    for (variant, stats) in comparison.items():
+        print(variant)
+        print('  Total score:', round(stats['total_score'], 3))
+        if stats['unscored_steps'] > 0:
+            print('  Steps that could not be scored:', stats['unscored_steps'], 'of', len(result['scores'][variant]))
+        print('  Steps with a different score:', stats['changed_steps'], 'of', len(result['scores'][variant]))
+        print('  Mean score difference:', round(stats['mean_delta'], 4), ' Biggest:', round(stats['max_delta'], 4))
+        print('  Rule counts:', ', '.join(str(rule) + ': ' + str(count)
+                                          for (rule, count) in sorted(stats['rule_counts'].items())))
+        changed = [(number, delta) for (number, delta) in zip(numbers, stats['return_deltas'].tolist()) if delta]
+        print('  Episodes with a different return:', len(changed), 'of', len(numbers))
+        for (number, delta) in changed[:10]:
+            print('    Episode', number, 'return difference', round(delta, 3))
+
+
+if __name__ == '__main__':
+    replay_result = replay(sys.argv[1], sys.argv[2:])
+    print_comparison(replay_result, compare(replay_result))
@@ -1,24 +1,305 @@
-
-
+import atexit
 import math
+import sys
 import time
+import zlib
+
+MAX_SPEED = 2.0                         # From Action Space settings.
+MAX_STEER = 30.0                        # From Action Space settings.
+
+# Thresholds used by Agent to work out its booleans.
+NEAR_CENTRE = 0.1                       # Fraction of track width from centre that is near centre of track.
+QUITE_NEAR_CENTRE = 0.25                # Fraction of track width from centre that is quite near centre of track.
+DIRECTION_THRESHOLD = 10.0              # Degrees between track direction and car heading that is right direction.
+FAST = 0.9                              # Fraction of max speed that is going fast.
+SLOW = 0.51                             # Fraction of max speed that is going slowly.
+HARD_STEER = 0.9                        # Fraction of max steer that is turning hard.
+
+# Score for each level of reward.
+REWARD_MAP = {"Very Big": 1.0,
+              "Big": 0.75,
+              "Small": 0.45,
+              "Default": 0.1,
+              "Penalise": -1.0}
+
+# The booleans that driving rules are made from, in the order of their bits in a predicate mask.
+PREDICATES = ('all_wheels_on_track',
+              'near_centre_of_track',
+              'quite_near_centre_of_track',
+              'heading_in_right_direction',
+              'turning_hard',
+              'going_straight',
+              'going_fast',
+              'going_slowly',
+              'correcting_course')
+
+# The driving rules. Each rule is (rule number, description, reward level, priority, conditions). The conditions are
+# the names of PREDICATES that must all be true for the rule to be met, with 'not ' in front of any that must be false.
+# When more than one rule is met, the one with the highest priority wins (or the later one in the list, if the
+# priorities are the same). A rule with no conditions is always met. After changing the rules, call compile_rules().
+RULES = [(0, "Default.", "Default", 0, ()),
+         (1, "Doing OK; not doing great.", "Small", 1,
+          ('quite_near_centre_of_track', 'not turning_hard', 'not going_fast')),
+         (2, "On track, not quite near centre, slow, steering back towards centre.", "Small", 2,
+          ('all_wheels_on_track', 'not quite_near_centre_of_track', 'going_slowly', 'correcting_course')),
+         (3, "Near centre of track, not straight, but not fast either.", "Small", 3,
+          ('near_centre_of_track', 'heading_in_right_direction', 'not going_straight', 'not going_fast',
+           'not turning_hard')),
+         (4, "Cornering nicely around a tight corner.", "Big", 4,
+          ('turning_hard', 'quite_near_centre_of_track', 'heading_in_right_direction', 'going_slowly')),
+         (5, "Middle of track, fast and straight in right direction.", "Very Big", 5,
+          ('near_centre_of_track', 'heading_in_right_direction', 'going_fast', 'going_straight')),
+         (6, "Going fast and turning hard.", "Penalise", 6,
+          ('going_fast', 'turning_hard')),
+         (7, "Going fast near edge of track.", "Penalise", 7,
+          ('going_fast', 'not quite_near_centre_of_track')),
+         (8, "At least one wheel off the track.", "Penalise", 8,
+          ('not all_wheels_on_track',))]
+
+# How often Reward.waypoints_out() sends the track waypoints to stdout,
+# 'every_step'  - On every call of the reward function.
+# 'on_change'   - Only when the waypoints are different to the ones sent last time.
+# 'per_episode' - At the start of each episode, and whenever the waypoints change.
+WAYPOINTS_MODE = 'per_episode'
+
+# How Reward.status_out() sends each status to stdout,
+# 'text'    - A TRACE_STATUS line, which is easy for people to read.
+# 'compact' - A shorter TRACE_COMPACT line, with the booleans packed into one number, and the rule given by its number.
+#             The description of each rule is sent once, in a TRACE_RULE line, the first time that the rule is used.
+# 'off'     - No trace at all, not even the waypoints.
+TRACE_FORMAT = 'text'
+
+# Number of trace lines to hold back and then write to stdout in one go. 1 writes every line straight away.
+TRACE_BATCH_SIZE = 1
+
+# Number of calls of the reward function between TRACE_PROFILE lines. Each one gives the time spent in each phase of
+# the reward function, and how many times each rule was met, since the one before. 0 turns profiling off.
+PROFILE_INTERVAL = 0
+PROFILE_BUCKETS = 32                    # Timing histograms have one bucket per power of 2 nanoseconds, up to this.
+
+# Phases of the reward function that are timed when profiling.
+PROFILE_PHASES = ('update',
+                  'check_track_position',
+                  'check_direction',
+                  'check_speed',
+                  'check_steering',
+                  'check_correcting_course',
+                  'reward_and_punish',
+                  'status_out',
+                  'waypoints_out')
+
+# Trace line formats, made once rather than by joining strings on every call.
+STATUS_LINE = 'TRACE_STATUS' + ' %s' * 27 + '\n'
+COMPACT_STATUS_LINE = 'TRACE_COMPACT' + ' %s' * 16 + '\n'
+RULE_LINE = 'TRACE_RULE %s %s %s\n'
+PROFILE_LINE = 'TRACE_PROFILE %s %s %s %s\n'
+BOOL_STRINGS = ('false', 'true')
+
+
+# The parm waypoints as they are written in a TRACE_WAYPOINTS line, eg. '0 5.2 0.59 1 5.3 0.62 ...'
+def waypoints_text(waypoints):
+    wp = []
+    counter = 0
+    for [x, y] in waypoints:
+        wp.append(str(counter) + ' ' + str(x) + ' ' + str(y))
+        counter += 1
+    return ' '.join(wp)
+
+
+# Short fingerprint of a track, made from its waypoints as they are written in a TRACE_WAYPOINTS line.
+# parse_logs makes the same fingerprint from the TRACE_WAYPOINTS line, to match statuses up with their waypoints.
+def track_fingerprint(waypoints_text):
+    return '%08x' % zlib.crc32(waypoints_text.encode())
+
+
+# Direction, in degrees, of the centre line of the track from one waypoint to the next.
+def segment_heading(prev_point, next_point):
+    # Calculate the direction in radius, arctan2(dy, dx), the result is (-pi, pi) in radians.
+    track_direction = math.atan2(next_point[1] - prev_point[1], next_point[0] - prev_point[0])
+    # Convert to degrees.
+    return math.degrees(track_direction)
+
+
+# Geometry of a track, worked out once from its waypoints, so that the reward function can look it up rather than
+# working it out on every call. Item i of each list is about the segment of track from waypoint i to waypoint i + 1,
+# (the last segment goes from the last waypoint back to the first).
+class TrackGeometry:
+
+    def __init__(self, waypoints):
+        count = len(waypoints)
+        self.headings = []                          # Direction of each segment, in degrees.
+        self.lengths = []                           # Length of each segment.
+        self.cumulative_distance = []               # Distance along the track to the start of each segment.
+        self.curvature = []                         # Change of direction, in degrees per unit of distance, from the
+                                                    # previous segment to this one. Positive means turning left.
+        distance = 0.0
+        for i in range(count):
+            prev_point = waypoints[i]
+            next_point = waypoints[(i + 1) % count]
+            self.headings.append(segment_heading(prev_point, next_point))
+            self.lengths.append(math.hypot(next_point[0] - prev_point[0], next_point[1] - prev_point[1]))
+            self.cumulative_distance.append(distance)
+            distance += self.lengths[-1]
+        self.track_length = distance
+
+        for i in range(count):
+            turn = (self.headings[i] - self.headings[i - 1] + 180.0) % 360.0 - 180.0
+            average_length = (self.lengths[i] + self.lengths[i - 1]) / 2
+            self.curvature.append(turn / average_length if average_length > 0 else 0.0)
+
+
+# TrackGeometry of each track seen so far, keyed by track fingerprint.
+track_geometries = {}
+
+
+def get_track_geometry(fingerprint, waypoints):
+    if fingerprint not in track_geometries:
+        track_geometries[fingerprint] = TrackGeometry(waypoints)
+    return track_geometries[fingerprint]
+
+
+# Remembers the last waypoints seen, so that the waypoints only need to be turned into a string, and sent to stdout,
+# when they change or a new episode starts.
+class TrackTrace:
+
+    def __init__(self):
+        self.waypoints = None
+        self.text = ''
+        self.fingerprint = ''
+        self.geometry = None
+        self.changed = False
+        self.new_episode = False
+        self.last_steps = None
+
+    def update(self, state):
+        # Same list as last time is the usual case, and is the cheapest to check.
+        self.changed = (state.waypoints is not self.waypoints) and (state.waypoints != self.waypoints)
+        if self.changed:
+            self.waypoints = state.waypoints
+            self.text = waypoints_text(state.waypoints)
+            self.fingerprint = track_fingerprint(self.text)
+            self.geometry = get_track_geometry(self.fingerprint, state.waypoints)
+
+        # The steps counter goes back to the start (0 or 1) at the beginning of each episode.
+        self.new_episode = (self.last_steps is None or (state.steps <= self.last_steps and state.steps <= 1))
+        self.last_steps = state.steps
+
+    # Should the waypoints be sent to stdout this time?
+    def should_send(self):
+        if WAYPOINTS_MODE == 'on_change':
+            return self.changed
+        if WAYPOINTS_MODE == 'per_episode':
+            return self.changed or self.new_episode
+        return True
+
+
+track_trace = TrackTrace()
+
+
+# Writes trace lines to stdout, one write per line, or per batch of TRACE_BATCH_SIZE lines.
+class TraceWriter:
+
+    def __init__(self):
+        self.lines = []
+        self.rules_sent = set()                 # Rule numbers that have had a TRACE_RULE line.
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= TRACE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            sys.stdout.write(''.join(self.lines))
+            self.lines = []
+
+
+trace_writer = TraceWriter()
+atexit.register(trace_writer.flush)             # Don't lose the last batch.
+
+
+# Counts and timings of the reward function, since the last TRACE_PROFILE line. Only used if PROFILE_INTERVAL is set.
+class Profiler:
+
+    __slots__ = ('calls', 'totals', 'histograms', 'rule_counts')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.totals = [0] * len(PROFILE_PHASES)                         # Nanoseconds spent in each phase.
+        self.histograms = [[0] * PROFILE_BUCKETS for _ in PROFILE_PHASES]
+        self.rule_counts = {}                                           # Rule number -> times it was met.
+
+    # Record that the parm phase, an index of PROFILE_PHASES, took parm ns nanoseconds.
+    # Bucket n of the histogram counts the times that took from 2 ** (n - 1) up to 2 ** n nanoseconds.
+    def record(self, phase, ns):
+        self.totals[phase] += ns
+        self.histograms[phase][min(ns.bit_length(), PROFILE_BUCKETS - 1)] += 1
+
+    # Make a TRACE_PROFILE line. Each phase is written as <phase>=<total ns>:<bucket>/<count>,... and the rules as
+    # rules=<rule number>/<count>,... leaving out anything with a count of 0.
+    def line(self):
+        phases = []
+        for (name, total, histogram) in zip(PROFILE_PHASES, self.totals, self.histograms):
+            buckets = ','.join(str(bucket) + '/' + str(count) for (bucket, count) in enumerate(histogram) if count)
+            phases.append(name + '=' + str(total) + ':' + buckets)
+        rules = ','.join(str(number) + '/' + str(count) for (number, count) in sorted(self.rule_counts.items()))
+        return PROFILE_LINE % (time.time(), self.calls, ' '.join(phases), 'rules=' + rules)
+
+
+profiler = Profiler()
+
+
+# Turn the parm rules (see RULES) into a list of (rule number, description, reward level, score) with an item for every
+# possible predicate mask, so that finding the rule met by the car is a single look up, however many rules there are.
+def compile_rules(rules):
+    bits = {name: 1 << bit for (bit, name) in enumerate(PREDICATES)}
+    compiled = []
+    for (number, description, level, priority, conditions) in rules:
+        required = 0
+        forbidden = 0
+        for condition in conditions:
+            name = condition[4:] if condition.startswith('not ') else condition
+            if name not in bits:
+                raise ValueError('Rule ' + str(number) + ' has unknown condition: ' + condition)
+            if name == condition:
+                required |= bits[name]
+            else:
+                forbidden |= bits[name]
+        compiled.append((priority, required, forbidden, (number, description, level, REWARD_MAP[level])))
+
+    outcomes = []
+    for mask in range(1 << len(PREDICATES)):
+        best = None
+        best_priority = None
+        for (priority, required, forbidden, outcome) in compiled:
+            if mask & required == required and mask & forbidden == 0 and (best is None or priority >= best_priority):
+                best = outcome
+                best_priority = priority
+        if best is None:
+            raise ValueError('No rule is met for predicate mask ' + str(mask) + ', add a rule with no conditions.')
+        outcomes.append(best)
+    return outcomes
 
 
-def bool_to_string(b):
-    if b:
-        return "true"
-    else:
-        return "false"
-
+RULE_OUTCOMES = compile_rules(RULES)
 
 
 class Environment:
 
-    def __init__(self, params):
+    __slots__ = ('all_wheels_on_track', 'x', 'y', 'distance_from_center', 'is_left_of_center', 'heading', 'progress',
+                 'steps', 'speed', 'steering_angle', 'track_width', 'waypoints', 'closest_waypoints')
+
+    def __init__(self, params=None):
+        if params is not None:
+            self.update(params)
 
-        # Extract some variables from the params.
-        # See this page for details,
-        # https://docs.aws.amazon.com/deepracer/latest/developerguide/deepracer-reward-function-input.html
+    # Extract some variables from the params, overwriting those from the last call.
+    # See this page for details,
+    # https://docs.aws.amazon.com/deepracer/latest/developerguide/deepracer-reward-function-input.html
+    def update(self, params):
         self.all_wheels_on_track = params['all_wheels_on_track']
         self.x = params['x']
         self.y = params['y']
@@ -36,12 +317,18 @@ class Environment:
 
 class Agent:
 
-    def __init__(self, state):
+    __slots__ = ('state', 'geometry', 'max_speed', 'max_steer', 'near_centre_of_track', 'quite_near_centre_of_track',
+                 'heading_in_right_direction', 'turning_hard', 'going_straight', 'going_fast', 'going_slowly',
+                 'correcting_course')
+
+    # geometry is the TrackGeometry of the track, if known, which saves working out the direction of the track.
+    def __init__(self, state, geometry=None):
 
         # Many of the booleans will default to False. Later methods will set them correctly.
         self.state = state
-        self.max_speed = 2.0                            # From Action Space settings.
-        self.max_steer = 30.0                           # From Action Space settings.
+        self.geometry = geometry
+        self.max_speed = MAX_SPEED
+        self.max_steer = MAX_STEER
         self.near_centre_of_track = False
         self.quite_near_centre_of_track = False
         self.heading_in_right_direction = False
@@ -51,39 +338,50 @@ class Agent:
         self.going_slowly = False
         self.correcting_course = False
 
+    # Pack the booleans into a predicate mask, with the bits in the order of PREDICATES.
+    def predicate_mask(self):
+        return (self.state.all_wheels_on_track
+                | self.near_centre_of_track << 1
+                | self.quite_near_centre_of_track << 2
+                | self.heading_in_right_direction << 3
+                | self.turning_hard << 4
+                | self.going_straight << 5
+                | self.going_fast << 6
+                | self.going_slowly << 7
+                | self.correcting_course << 8)
+
     # Is car near, or quite near, to centre of the track?
     def check_track_position(self):
-        marker_1 = 0.1 * self.state.track_width
-        marker_2 = 0.25 * self.state.track_width
+        marker_1 = NEAR_CENTRE * self.state.track_width
+        marker_2 = QUITE_NEAR_CENTRE * self.state.track_width
         self.near_centre_of_track = (self.state.distance_from_center <= marker_1)
         self.quite_near_centre_of_track = (self.state.distance_from_center <= marker_2)
 
     # Is the car pointing in the approximate direction that the track is heading?
     def check_direction(self):
-        # Calculate the direction of the center line based on the closest waypoints.
-        next_point = self.state.waypoints[self.state.closest_waypoints[1]]
-        prev_point = self.state.waypoints[self.state.closest_waypoints[0]]
+        [prev_waypoint, next_waypoint] = self.state.closest_waypoints
+        geometry = self.geometry
 
-        # Calculate the direction in radius, arctan2(dy, dx), the result is (-pi, pi) in radians.
-        track_direction = math.atan2(next_point[1] - prev_point[1], next_point[0] - prev_point[0])
-        # Convert to degrees.
-        track_direction = math.degrees(track_direction)
+        if geometry is not None and next_waypoint == (prev_waypoint + 1) % len(geometry.headings):
+            # Usual case, the closest waypoints are next to each other, so look up the direction of the track.
+            track_direction = geometry.headings[prev_waypoint]
+        else:
+            track_direction = segment_heading(self.state.waypoints[prev_waypoint], self.state.waypoints[next_waypoint])
 
         # Calculate the difference between the track direction and the heading direction of the car
         direction_diff = abs(track_direction - self.state.heading)
 
         # If track direction and car heading are close, set the boolean to True.
-        direction_threshold = 10.0
-        self.heading_in_right_direction = (direction_diff < direction_threshold)
+        self.heading_in_right_direction = (direction_diff < DIRECTION_THRESHOLD)
 
     # Is the car going fast or slowly?
     def check_speed(self):
-        self.going_fast = (self.state.speed > 0.9 * self.max_speed)
-        self.going_slowly = (self.state.speed <= 0.51 * self.max_speed)
+        self.going_fast = (self.state.speed > FAST * self.max_speed)
+        self.going_slowly = (self.state.speed <= SLOW * self.max_speed)
 
     # Is the car turning hard or going in straight line?
     def check_steering(self):
-        hard_steer = self.max_steer * 0.9
+        hard_steer = self.max_steer * HARD_STEER
         self.turning_hard = (abs(self.state.steering_angle) > hard_steer)
         self.going_straight = (self.state.steering_angle == 0.0)
 
@@ -97,6 +395,8 @@ class Agent:
 
 class Reward:
 
+    __slots__ = ('car', 'rule_number', 'rule_description', 'reward_level', 'score')
+
     def __init__(self, car):
         self.car = car
         self.rule_number = 0
@@ -104,129 +404,158 @@ class Reward:
         self.reward_level = ""
         self.score = 0.0
 
-    # A driving rule has been met. Figure out the reward score.
-    def rule_met(self, rule_number, rule_description, reward_level):
-        self.rule_number = rule_number
-        self.rule_description = rule_description
-        self.reward_level = reward_level
-
-        reward_map = {"Very Big": 1.0,
-                      "Big": 0.75,
-                      "Small": 0.45,
-                      "Default": 0.1,
-                      "Penalise": -1.0}
-        self.score = reward_map.get(reward_level)
-
+    # Look up the rule met by the car, from the booleans it has worked out. See RULES.
     def reward_and_punish(self):
-        # 0. Start with quite small, default reward.
-        self.rule_met(0, "Default.", "Default")
-
-        # 1. Doing OK; not doing great.
-        if (self.car.quite_near_centre_of_track
-                and not self.car.turning_hard
-                and not self.car.going_fast):
-            self.rule_met(1, "Doing OK; not doing great.", "Small")
-
-        # 2. Car on track, but not quite near centre, going slowly, steering back towards centre.
-        if (self.car.state.all_wheels_on_track
-                and not self.car.quite_near_centre_of_track
-                and self.car.going_slowly
-                and self.car.correcting_course):
-            self.rule_met(2, "On track, not quite near centre, slow, steering back towards centre.", "Small")
-
-        # 3. Near centre of track, not straight, but not fast either.
-        if (self.car.near_centre_of_track
-                and self.car.heading_in_right_direction
-                and not self.car.going_straight
-                and not self.car.going_fast
-                and not self.car.turning_hard):
-            self.rule_met(3, "Near centre of track, not straight, but not fast either.", "Small")
-
-        # 4. Cornering nicely around a tight corner.
-        if (self.car.turning_hard
-                and self.car.quite_near_centre_of_track
-                and self.car.heading_in_right_direction
-                and self.car.going_slowly):
-            self.rule_met(4, "Cornering nicely around a tight corner.", "Big")
-
-        # 5. Middle of track, fast and straight in right direction.
-        if (self.car.near_centre_of_track
-                and self.car.heading_in_right_direction
-                and self.car.going_fast
-                and self.car.going_straight):
-            self.rule_met(5, "Middle of track, fast and straight in right direction.", "Very Big")
-
-        # 6. Going fast and turning hard.
-        if (self.car.going_fast
-                and self.car.turning_hard):
-            self.rule_met(6, "Going fast and turning hard.", "Penalise")
-
-        # 7. Going fast near edge of track.
-        if (self.car.going_fast
-                and not self.car.quite_near_centre_of_track):
-            self.rule_met(7, "Going fast near edge of track.", "Penalise")
-
-        # 8. At least one wheel off the track.
-        if not self.car.state.all_wheels_on_track:
-            self.rule_met(8, "At least one wheel off the track.", "Penalise")
+        outcome = RULE_OUTCOMES[self.car.predicate_mask()]
+        (self.rule_number, self.rule_description, self.reward_level, self.score) = outcome
 
     # Send info about status to stdout.
     # AWS will send this to the CLoudWatch logs, /aws/robomaker/SimulationJobs
     def status_out(self):
-        print('TRACE_STATUS '
-              + str(time.time()) + ' '                                     # Trace items are space delimeted.
-              + bool_to_string(self.car.state.all_wheels_on_track) + ' '   # True becomes 'true', False becomes 'false'
-              + str(self.car.state.x) + ' '
-              + str(self.car.state.y) + ' '
-              + str(self.car.state.distance_from_center) + ' '
-              + bool_to_string(self.car.state.is_left_of_center) + ' '
-              + str(self.car.state.heading) + ' '
-              + str(self.car.state.progress) + ' '
-              + str(self.car.state.steps) + ' '
-              + str(self.car.state.speed) + ' '
-              + str(self.car.state.steering_angle) + ' '
-              + str(self.car.state.track_width) + ' '
-              + str(self.car.max_speed) + ' '
-              + str(self.car.max_steer) + ' '
-              + bool_to_string(self.car.near_centre_of_track) + ' '
-              + bool_to_string(self.car.quite_near_centre_of_track) + ' '
-              + bool_to_string(self.car.heading_in_right_direction) + ' '
-              + bool_to_string(self.car.turning_hard) + ' '
-              + bool_to_string(self.car.going_straight) + ' '
-              + bool_to_string(self.car.going_fast) + ' '
-              + bool_to_string(self.car.going_slowly) + ' '
-              + bool_to_string(self.car.correcting_course) + ' '
-              + str(self.rule_number) + ' '
-              + self.rule_description.replace(' ', '_') + ' '              # Because space is the delimeter...
-              + self.reward_level.replace(' ', '_') + ' '                  # need to replace it with underscore.
-              + str(self.score))
-
+        if TRACE_FORMAT == 'off':
+            return
+
+        car = self.car
+        state = car.state
+
+        if TRACE_FORMAT == 'compact':
+            # Describe each rule the first time that it is used, so that the status lines only need its number.
+            if self.rule_number not in trace_writer.rules_sent:
+                trace_writer.rules_sent.add(self.rule_number)
+                trace_writer.write(RULE_LINE % (self.rule_number,
+                                                self.reward_level.replace(' ', '_'),
+                                                self.rule_description.replace(' ', '_')))
+
+            # Same order of booleans as the TRACE_STATUS line.
+            flags = (state.all_wheels_on_track
+                     | state.is_left_of_center << 1
+                     | car.near_centre_of_track << 2
+                     | car.quite_near_centre_of_track << 3
+                     | car.heading_in_right_direction << 4
+                     | car.turning_hard << 5
+                     | car.going_straight << 6
+                     | car.going_fast << 7
+                     | car.going_slowly << 8
+                     | car.correcting_course << 9)
+
+            trace_writer.write(COMPACT_STATUS_LINE % (time.time(), state.x, state.y, state.distance_from_center,
+                                                      state.heading, state.progress, state.steps, state.speed,
+                                                      state.steering_angle, state.track_width, car.max_speed,
+                                                      car.max_steer, flags, self.rule_number, self.score,
+                                                      track_trace.fingerprint))
+            return
+
+        trace_writer.write(STATUS_LINE % (time.time(),
+                                          BOOL_STRINGS[state.all_wheels_on_track],     # True becomes 'true'.
+                                          state.x,
+                                          state.y,
+                                          state.distance_from_center,
+                                          BOOL_STRINGS[state.is_left_of_center],
+                                          state.heading,
+                                          state.progress,
+                                          state.steps,
+                                          state.speed,
+                                          state.steering_angle,
+                                          state.track_width,
+                                          car.max_speed,
+                                          car.max_steer,
+                                          BOOL_STRINGS[car.near_centre_of_track],
+                                          BOOL_STRINGS[car.quite_near_centre_of_track],
+                                          BOOL_STRINGS[car.heading_in_right_direction],
+                                          BOOL_STRINGS[car.turning_hard],
+                                          BOOL_STRINGS[car.going_straight],
+                                          BOOL_STRINGS[car.going_fast],
+                                          BOOL_STRINGS[car.going_slowly],
+                                          BOOL_STRINGS[car.correcting_course],
+                                          self.rule_number,
+                                          self.rule_description.replace(' ', '_'),     # Because space is the...
+                                          self.reward_level.replace(' ', '_'),         # delimeter, use underscore.
+                                          self.score,
+                                          track_trace.fingerprint))                    # Which waypoints it goes with.
+
+    # Send the waypoints to stdout, but only as often as WAYPOINTS_MODE says.
     def waypoints_out(self):
-        wp = 'TRACE_WAYPOINTS '
-        counter = 0
-        for [x, y] in self.car.state.waypoints:
-            if counter != 0:
-                wp = wp + ' '
-            wp += str(counter) + ' ' + str(x) + ' ' + str(y)
-            counter += 1
+        if TRACE_FORMAT != 'off' and track_trace.should_send():
+            trace_writer.write('TRACE_WAYPOINTS ' + track_trace.text + '\n')
 
-        print(wp)
 
+# Works out the reward for each call of the reward function. The Environment, Agent and Reward objects are made once
+# and then updated in place on every call, so that no new objects are made while the simulator is running.
+class RewardEngine:
 
-def reward_function(params):
+    __slots__ = ('state', 'car', 'reinforcement', 'phases')
+
+    def __init__(self):
+        self.state = Environment()
+        self.car = Agent(self.state)
+        self.reinforcement = Reward(self.car)
+
+        # The methods called for each of PROFILE_PHASES after the first, in order.
+        self.phases = [self.car.check_track_position,
+                       self.car.check_direction,
+                       self.car.check_speed,
+                       self.car.check_steering,
+                       self.car.check_correcting_course,
+                       self.reinforcement.reward_and_punish,
+                       self.reinforcement.status_out,
+                       self.reinforcement.waypoints_out]
 
-    state = Environment(params)
-    car = Agent(state)
-    reinforcement = Reward(car)
+    def reward(self, params):
+        if PROFILE_INTERVAL:
+            return self.profiled_reward(params)
 
-    car.check_track_position()
-    car.check_direction()
-    car.check_speed()
-    car.check_steering()
-    car.check_correcting_course()
+        state = self.state
+        car = self.car
+        reinforcement = self.reinforcement
 
-    reinforcement.reward_and_punish()
-    reinforcement.status_out()
-    reinforcement.waypoints_out()
+        state.update(params)
+        track_trace.update(state)
+        car.geometry = track_trace.geometry
 
-    return float(reinforcement.score)
+        car.check_track_position()
+        car.check_direction()
+        car.check_speed()
+        car.check_steering()
+        car.check_correcting_course()
+
+        reinforcement.reward_and_punish()
+        reinforcement.status_out()
+        reinforcement.waypoints_out()
+
+        return float(reinforcement.score)
+
+    # The same as reward(), but timing each phase, and every PROFILE_INTERVAL calls writing a TRACE_PROFILE line.
+    def profiled_reward(self, params):
+        clock = time.perf_counter_ns
+        record = profiler.record
+
+        start = clock()
+        self.state.update(params)
+        track_trace.update(self.state)
+        self.car.geometry = track_trace.geometry
+        end = clock()
+        record(0, end - start)
+
+        phase = 1
+        for method in self.phases:
+            start = end
+            method()
+            end = clock()
+            record(phase, end - start)
+            phase += 1
+
+        rule_number = self.reinforcement.rule_number
+        profiler.rule_counts[rule_number] = profiler.rule_counts.get(rule_number, 0) + 1
+        profiler.calls += 1
+        if profiler.calls >= PROFILE_INTERVAL:
+            trace_writer.write(profiler.line())
+            profiler.reset()
+
+        return float(self.reinforcement.score)
+
+
+engine = RewardEngine()
+
+
+def reward_function(params):
+    return engine.reward(params)
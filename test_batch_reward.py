@@ -0,0 +1,83 @@
+# Tests that batches of steps get exactly the same rewards as the reward function gives.
+
+import batch_reward as br
+import reward_function as rf
+import parse_logs as pl
+import numpy as np
+import unittest
+
+
+# Run the scalar reward function for the parm params, returning its Agent and Reward.
+def scalar_reward(params):
+    car = rf.Agent(rf.Environment(params))
+    car.check_track_position()
+    car.check_direction()
+    car.check_speed()
+    car.check_steering()
+    car.check_correcting_course()
+    reinforcement = rf.Reward(car)
+    reinforcement.reward_and_punish()
+    return car, reinforcement
+
+
+class TestBatchReward(unittest.TestCase):
+
+    def setUp(self):
+        (waypoints, self.statuses) = pl.filename_to_status_columns('truncated_simulation_log.txt')
+        self.batch = br.batch_from_statuses(self.statuses, waypoints)
+
+        # Random steps as well, with plenty of values on the thresholds between rules.
+        random = np.random.default_rng(0)
+        count = 5000
+        track_width = random.choice([0.6, 1.0], count)
+        self.random_batch = {'all_wheels_on_track': random.random(count) < 0.8,
+                             'distance_from_center': track_width * random.choice([0.0, 0.1, 0.2, 0.25, 0.4], count),
+                             'is_left_of_center': random.random(count) < 0.5,
+                             'heading': random.uniform(-180, 180, count),
+                             'speed': random.choice([0.0, 1.0, 1.02, 1.5, 1.8, 2.0], count),
+                             'steering_angle': random.choice([-30.0, -27.0, -15.0, 0.0, 15.0, 27.0, 30.0], count),
+                             'track_width': track_width,
+                             'waypoints': self.batch['waypoints'],
+                             'closest_waypoints': random.integers(0, len(self.batch['waypoints']), (count, 2))}
+
+    # Make the params of the reward function for row i of the parm batch.
+    def params(self, batch, i):
+        params = {name: batch[name][i] for name in ['all_wheels_on_track', 'distance_from_center',
+                                                     'is_left_of_center', 'heading', 'speed', 'steering_angle',
+                                                     'track_width']}
+        params.update({'x': 0.0, 'y': 0.0, 'progress': 0.0, 'steps': 0, 'waypoints': batch['waypoints'],
+                       'closest_waypoints': list(batch['closest_waypoints'][i])})
+        return params
+
+    def test_same_as_reward_function(self):
+        for batch in [self.batch, self.random_batch]:
+            output = br.batch_reward(batch)
+            for i in range(len(batch['track_width'])):
+                (car, reinforcement) = scalar_reward(self.params(batch, i))
+                for name in ['near_centre_of_track', 'quite_near_centre_of_track', 'heading_in_right_direction',
+                             'turning_hard', 'going_straight', 'going_fast', 'going_slowly', 'correcting_course']:
+                    self.assertEqual(output[name][i], getattr(car, name))
+                self.assertEqual(output['rule_number'][i], reinforcement.rule_number)
+                self.assertEqual(output['reward_level'][i], reinforcement.reward_level)
+                self.assertEqual(output['score'][i], reinforcement.score)
+
+    def test_track_geometry_cached(self):
+        fingerprint = rf.track_fingerprint(rf.waypoints_text(self.batch['waypoints']))
+        rf.track_geometries.pop(fingerprint, None)
+        br.batch_reward(self.batch)
+        geometry = rf.track_geometries[fingerprint]
+
+        br.batch_reward(self.random_batch)                              # The same track, so the same geometry.
+        self.assertIs(rf.track_geometries[fingerprint], geometry)
+        trace = rf.TrackTrace()
+        trace.update(rf.Environment(self.params(self.batch, 0)))
+        self.assertIs(trace.geometry, geometry)
+
+    def test_find_closest_waypoints(self):
+        waypoints = [[0.0, 0.0], [1.0, 0.0], [2.0, 0.0], [2.0, 1.0]]
+        closest = br.find_closest_waypoints(np.array([0.9, 1.1, 0.1]), np.array([0.1, 0.1, -0.1]), waypoints)
+        self.assertEqual(closest.tolist(), [[0, 1], [1, 2], [0, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
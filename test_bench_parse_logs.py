@@ -0,0 +1,43 @@
+# Tests of the log parsing and visualisation benchmark.
+
+import bench_parse_logs as bench
+import episodes as ep
+import parse_logs as pl
+import os
+import tempfile
+import unittest
+
+
+class TestBenchParseLogs(unittest.TestCase):
+
+    def test_write_synthetic_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.txt')
+            for (steps, waypoints_mode) in [(1000, 'per_episode'), (300, 'every_step'), (10, 'per_episode')]:
+                written = bench.write_synthetic_log(filename, steps, waypoints_mode=waypoints_mode)
+                self.assertEqual(written, os.path.getsize(filename))
+
+                (waypoints, statuses) = pl.filename_to_status_columns(filename)
+                self.assertEqual(len(statuses), steps)
+                self.assertEqual(waypoints, pl.read_waypoints(bench.SAMPLE_FILENAME))
+
+                with open(filename, 'rb') as fileobj:
+                    waypoints_lines = fileobj.read().count(bench.WAYPOINTS_MARKER)
+                if waypoints_mode == 'every_step':
+                    self.assertEqual(waypoints_lines, steps)
+                else:
+                    self.assertEqual(waypoints_lines, len(ep.EpisodeIndex.from_statuses(statuses)))
+
+    def test_run_benchmark(self):
+        report = bench.run_benchmark([300])
+        [result] = report['results']
+        self.assertEqual(result['steps'], 300)
+        self.assertEqual(result['statuses'], 300)
+        for name in ['parse_mb_per_sec', 'parse_lines_per_sec', 'frames_per_sec']:
+            self.assertGreater(result[name], 0)
+        if bench.peak_rss() is not None:                                # Not measured on Windows.
+            self.assertGreater(result['peak_rss_bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
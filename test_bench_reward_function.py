@@ -0,0 +1,33 @@
+# Tests of the reward function benchmark.
+
+import bench_reward_function as bench
+import reward_function as rf
+import unittest
+
+
+class TestBenchRewardFunction(unittest.TestCase):
+
+    def test_run_benchmark(self):
+        trace_format = rf.TRACE_FORMAT
+        results = bench.run_benchmark(calls=500, latency_calls=200, allocation_calls=50)
+        self.assertEqual(rf.TRACE_FORMAT, trace_format)                     # Settings are put back afterwards.
+
+        self.assertEqual(list(results), bench.TRACE_FORMATS)
+        for format_results in results.values():
+            self.assertEqual(set(format_results), set(bench.BIGGER_IS_BETTER))
+            self.assertGreater(format_results['calls_per_sec'], 0)
+            self.assertLessEqual(format_results['p50_us'], format_results['p99_us'])
+        self.assertEqual(results['off']['stdout_bytes_per_call'], 0)
+        self.assertGreater(results['text']['stdout_bytes_per_call'], results['compact']['stdout_bytes_per_call'])
+
+    def test_compare(self):
+        baseline = {'off': {'calls_per_sec': 1000.0, 'p99_us': 10.0, 'stdout_bytes_per_call': 0.0}}
+        results = {'off': {'calls_per_sec': 800.0, 'p99_us': 10.5, 'stdout_bytes_per_call': 0.0, 'p50_us': 1.0}}
+        self.assertEqual(bench.compare(results, baseline),
+                         [('off', 'calls_per_sec', 1000.0, 800.0, 0.8, True),
+                          ('off', 'p99_us', 10.0, 10.5, 1.05, False),
+                          ('off', 'stdout_bytes_per_call', 0.0, 0.0, 1.0, False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
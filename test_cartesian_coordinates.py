@@ -1,6 +1,7 @@
 # A set of tests for the cartesian coordinates functions.
 
 import cartesian_coordinates as cc
+import numpy as np
 import unittest
 from math import sqrt
 
@@ -25,6 +26,30 @@ class TestCartesianCoordinates(unittest.TestCase):
     def test_rotate_around_a_point(self):
         self.assertEqual(cc.rotate_around_a_point([2.0, 3.0], [2.0, 2.0], 90.0), [3.0, 2.0])
 
+    def test_batch_functions(self):
+        vertices = [[2.0, 3.0], [1.0, 0.0], [-4.0, 0.5]]
+        for degrees in [90.0, -45.0, 123.4]:
+            np.testing.assert_allclose(cc.batch_rotate_around_origin(vertices, degrees),
+                                       [cc.rotate_around_origin(v, degrees) for v in vertices], atol=1e-12)
+            np.testing.assert_allclose(cc.batch_rotate_around_a_point(vertices, [2.0, 2.0], degrees),
+                                       [cc.rotate_around_a_point(v, [2.0, 2.0], degrees) for v in vertices],
+                                       atol=1e-12)
+        self.assertEqual(cc.batch_translation(vertices, [10.0, 11.0]).tolist(),
+                         [cc.translation(v, [10.0, 11.0]) for v in vertices])
+        self.assertEqual(cc.batch_scale(vertices, 5).tolist(), [cc.scale(v, 5) for v in vertices])
+
+    def test_batch_functions_many_shapes(self):
+        shapes = np.array([[[1.0, 0.0], [0.0, 1.0]],
+                           [[2.0, 2.0], [3.0, 1.0]]])
+        degrees = np.array([90.0, -30.0])
+        pivots = np.array([[0.0, 0.0], [2.0, 1.0]])
+        rotated = cc.batch_rotate_around_a_point(shapes, pivots, degrees)
+        for (shape, pivot, angle, result) in zip(shapes, pivots, degrees, rotated):
+            np.testing.assert_allclose(result, [cc.rotate_around_a_point(v, pivot, angle) for v in shape], atol=1e-12)
+
+        moved = cc.batch_translation(shapes, [[1.0, 1.0], [-1.0, 0.0]])
+        self.assertEqual(moved.tolist(), [[[2.0, 1.0], [1.0, 2.0]], [[1.0, 2.0], [2.0, 1.0]]])
+
 
 if __name__ == '__main__':
     unittest.main()
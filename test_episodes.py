@@ -0,0 +1,58 @@
+# Tests of the episode index.
+
+import episodes as ep
+import parse_logs as pl
+import numpy as np
+import unittest
+
+
+class TestEpisodes(unittest.TestCase):
+
+    def test_from_steps(self):
+        (_, statuses) = pl.filename_to_status_columns('truncated_simulation_log.txt')
+        index = ep.EpisodeIndex.from_statuses(statuses)
+
+        # Every episode starts at step 0, and has each step once, although not always logged in order.
+        self.assertEqual(len(index), 8)
+        for number in range(len(index)):
+            steps = list(index.episode(number).values('steps'))
+            self.assertEqual(sorted(steps), list(range(len(steps))))
+        self.assertEqual(sum(len(index.episode(number)) for number in range(len(index))), len(statuses))
+
+    def test_from_sim_trace(self):
+        (_, statuses) = pl.filename_to_status_columns('example_short_log.txt')
+        joined = pl.join_sim_trace(statuses, pl.filename_to_sim_trace_columns('example_short_log.txt'))
+        index = ep.EpisodeIndex.from_statuses(joined)
+
+        self.assertEqual(list(index.numbers), [1, 2])                   # Last episode's number is not known.
+        self.assertEqual(index.slice(1), slice(0, 3))
+
+    def test_summary(self):
+        (_, statuses) = pl.filename_to_status_columns('example_short_log.txt')
+        summary = ep.EpisodeIndex.from_statuses(statuses).summary()
+
+        self.assertEqual(len(summary), 2)
+        self.assertEqual(summary[0]['length'], 3)
+        self.assertEqual(summary[0]['final_progress'], statuses[2]['progress'])
+        self.assertEqual(summary[0]['total_reward'], sum(s['score'] for s in statuses[0:3]))
+        self.assertEqual(summary[0]['off_track_count'], 3)
+        self.assertEqual(summary[1]['off_track_count'], 0)
+
+    def test_summary_out_of_order(self):
+        (_, statuses) = pl.filename_to_status_columns('truncated_simulation_log.txt')
+        index = ep.EpisodeIndex.from_statuses(statuses)
+        rows = np.arange(len(statuses))
+        for end in index.ends.tolist():
+            rows[[end - 2, end - 1]] = rows[[end - 1, end - 2]]         # The final step is logged 2nd to last.
+        shuffled = statuses.take(rows)
+        summary = ep.EpisodeIndex.from_statuses(shuffled).summary()
+
+        self.assertEqual(len(summary), len(index))
+        for (number, final_progress) in enumerate(summary.values('final_progress').tolist()):
+            episode = index.episode(number)
+            self.assertEqual(final_progress, episode.values('progress')[episode.values('steps').argmax()])
+            self.assertNotEqual(final_progress, shuffled[int(index.ends[number]) - 1]['progress'])
+
+
+if __name__ == '__main__':
+    unittest.main()
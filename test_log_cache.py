@@ -0,0 +1,84 @@
+# Tests of the cache of parsed logs.
+
+import log_cache as lc
+import parse_logs as pl
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestLogCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'log.txt')
+        shutil.copy('example_short_log.txt', self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        self.assertIsNone(lc.load(self.filename))                       # Nothing cached yet.
+
+        parsed = pl.filename_to_status_columns(self.filename)
+        self.assertEqual(lc.load_status_columns(self.filename)[0], parsed[0])
+        self.assertTrue(os.path.exists(lc.cache_filename(self.filename)))
+
+        waypoints, statuses = lc.load(self.filename)
+        self.assertEqual(waypoints, parsed[0])
+        self.assertEqual(list(statuses), list(parsed[1]))
+
+    def test_stale_cache(self):
+        lc.load_status_columns(self.filename)
+
+        with open(self.filename, 'a') as fileobj:                      # Changing the log makes the cache stale.
+            fileobj.write('\n')
+        self.assertIsNone(lc.load(self.filename))
+
+        # Same size, but different contents.
+        with open(self.filename, 'rb') as fileobj:
+            contents = fileobj.read()
+        lc.save(self.filename, *pl.filename_to_status_columns(self.filename))
+        stat = os.stat(self.filename)
+        with open(self.filename, 'wb') as fileobj:
+            fileobj.write(contents.replace(b'Penalise', b'Penalize'))
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNone(lc.load(self.filename))
+
+    def test_corrupt_cache(self):
+        lc.load_status_columns(self.filename)
+        with open(lc.cache_filename(self.filename), 'rb') as fileobj:
+            contents = fileobj.read()
+
+        for corrupt in [contents[:len(contents) // 2], b'', b'not a cache']:          # Truncated, empty and junk.
+            with open(lc.cache_filename(self.filename), 'wb') as fileobj:
+                fileobj.write(corrupt)
+            self.assertIsNone(lc.load(self.filename))
+            self.assertEqual(len(lc.load_status_columns(self.filename)[1]), 4)       # Parsed again, ...
+            self.assertIsNotNone(lc.load(self.filename))                            # ... and cached again.
+
+    def test_unwritable_cache(self):
+        os.mkdir(lc.cache_filename(self.filename))                      # So that the cache can't be written.
+        self.assertFalse(lc.save(self.filename, *pl.filename_to_status_columns(self.filename)))
+        self.assertFalse(os.path.exists(lc.cache_filename(self.filename) + '.tmp'))
+
+    def test_appended_while_parsing(self):
+        parse = pl.filename_to_status_columns
+
+        def parse_then_append(filename, processes=1):
+            parsed = parse(filename, processes)
+            with open(filename, 'a') as fileobj:                       # More of the log arrives during the parse.
+                fileobj.write('\n')
+            return parsed
+
+        pl.filename_to_status_columns = parse_then_append
+        try:
+            lc.load_status_columns(self.filename)
+        finally:
+            pl.filename_to_status_columns = parse
+        self.assertIsNone(lc.load(self.filename))                       # What was parsed is not all of the log.
+
+
+if __name__ == '__main__':
+    unittest.main()
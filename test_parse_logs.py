@@ -1,6 +1,11 @@
 # Some tests of the log parsing code.
 
 import parse_logs as pl
+import bz2
+import gzip
+import io
+import os
+import tempfile
 import unittest
 
 
@@ -32,6 +37,175 @@ class TestParseLogs(unittest.TestCase):
         los = pl.make_list_of_statuses(statuses_only)
         self.assertEqual(len(los), 4)
 
+    def test_stream_log(self):
+        records = list(pl.stream_log('example_short_log.txt'))
+        record_types = [record_type for (record_type, _) in records]
+
+        # The 4 identical waypoints lines are only parsed once.
+        self.assertEqual(record_types.count('TRACE_WAYPOINTS'), 1)
+        self.assertEqual(record_types.count('TRACE_STATUS'), 4)
+
+        logs = pl.filename_to_list_of_strings('example_short_log.txt')
+        statuses = pl.make_list_of_statuses(pl.filter_by_2nd_item(logs, 'TRACE_STATUS'))
+        waypoints = pl.make_list_of_waypoints(pl.filter_by_2nd_item(logs, 'TRACE_WAYPOINTS'))
+        self.assertEqual([record for (record_type, record) in records if record_type == 'TRACE_STATUS'], statuses)
+        self.assertEqual(pl.read_waypoints('example_short_log.txt'), waypoints)
+
+    def test_status_stream(self):
+        stream = pl.StatusStream('example_short_log.txt')
+        self.assertEqual(len(stream), 4)
+        self.assertEqual(list(stream), list(stream))            # Can be iterated over more than once.
+
+    def test_filename_to_status_columns(self):
+        waypoints, columns = pl.filename_to_status_columns('example_short_log.txt')
+        self.assertEqual(waypoints, pl.read_waypoints('example_short_log.txt'))
+        self.assertEqual(len(columns), 4)
+
+        # Each row is the same as the dictionary that the list based parser makes.
+        statuses = [status for (record_type, status) in pl.stream_log('example_short_log.txt')
+                    if record_type == 'TRACE_STATUS']
+        self.assertEqual(list(columns), statuses)
+        self.assertEqual(columns[-1], statuses[-1])
+        self.assertEqual(list(columns[1:3]), statuses[1:3])
+
+        self.assertEqual(list(columns.values('all_wheels_on_track')), [s['all_wheels_on_track'] for s in statuses])
+        self.assertEqual(list(columns.values('reward_level')), [s['reward_level'] for s in statuses])
+        self.assertEqual(list(columns.values('x')), [s['x'] for s in statuses])
+
+    def test_many_text_values(self):
+        statuses = [status for (record_type, status) in pl.scan_log('example_short_log.txt')
+                    if record_type == 'TRACE_STATUS']
+        builder = pl.StatusColumnsBuilder()
+        for number in range(300):                               # More fingerprints than fit in a byte.
+            builder.add(statuses[number % len(statuses)][:28] + ['track' + str(number)])
+        columns = builder.build()
+
+        self.assertEqual(len(columns.lookups['track_fingerprint']), 300)
+        self.assertEqual(columns[299]['track_fingerprint'], 'track299')
+        joined = pl.concatenate_status_columns([columns, columns[:10]])
+        self.assertEqual(list(joined.values('track_fingerprint')[-10:]), ['track' + str(n) for n in range(10)])
+
+    def test_newline_aligned_ranges(self):
+        with open('truncated_simulation_log.txt', 'rb') as fileobj:
+            contents = fileobj.read()
+
+        ranges = pl.newline_aligned_ranges('truncated_simulation_log.txt', 7)
+        self.assertEqual(b''.join(contents[start:end] for (start, end) in ranges), contents)
+        for (start, _) in ranges[1:]:
+            self.assertEqual(contents[start - 1:start], b'\n')
+
+    def test_parallel_filename_to_status_columns(self):
+        (waypoints, statuses) = pl.filename_to_status_columns('truncated_simulation_log.txt')
+        (parallel_waypoints, parallel_statuses) = pl.filename_to_status_columns('truncated_simulation_log.txt',
+                                                                                processes=3)
+        self.assertEqual(parallel_waypoints, waypoints)
+        self.assertEqual(list(parallel_statuses), list(statuses))
+
+    def test_empty_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.txt')
+            open(filename, 'w').close()
+            for processes in [1, 3]:
+                (waypoints, statuses) = pl.filename_to_status_columns(filename, processes=processes)
+                self.assertEqual(waypoints, [])
+                self.assertEqual(len(statuses), 0)
+
+    def test_scan_log(self):
+        record_types = ('TRACE_STATUS', 'TRACE_WAYPOINTS', 'SIM_TRACE_LOG')
+        with open('truncated_simulation_log.txt', 'rb') as fileobj:
+            contents = fileobj.read()
+        scanned = list(pl.scan_buffer(contents, record_types))
+
+        # The same records, whether the log is scanned in one go, memory mapped, or a range at a time.
+        self.assertEqual(list(pl.scan_log('truncated_simulation_log.txt', record_types)), scanned)
+        seen = {}
+        in_ranges = []
+        for (start, end) in pl.newline_aligned_ranges('truncated_simulation_log.txt', 5):
+            in_ranges += pl.scan_buffer(contents, record_types, start, end, seen)
+        self.assertEqual(in_ranges, scanned)
+
+        lines = contents.decode().splitlines()
+        record_types = [record_type for (record_type, _) in scanned]
+        self.assertEqual(record_types.count('SIM_TRACE_LOG'), 262)
+        self.assertEqual(record_types.count('TRACE_STATUS'), sum(1 for line in lines if ' TRACE_STATUS ' in line))
+        self.assertEqual(record_types.count('TRACE_WAYPOINTS'), 1)                  # Repeats are only yielded once.
+        self.assertEqual([s for (record_type, s) in scanned if record_type == 'TRACE_STATUS'][0],
+                         next(line for line in lines if ' TRACE_STATUS ' in line).split(' '))
+        self.assertEqual(list(pl.scan_log('example_data_1.txt')), [])
+
+    def test_filename_to_sim_trace_columns(self):
+        sim_trace = pl.filename_to_sim_trace_columns('example_short_log.txt')
+        self.assertEqual(len(sim_trace), 5)
+        self.assertEqual(list(sim_trace.values('steps')), [8, 9, 10, 11, 12])
+        self.assertEqual(list(sim_trace.values('done')), [False, False, False, False, True])
+        self.assertAlmostEqual(sim_trace[0]['steering_angle'], -29.7938, places=3)     # Radians become degrees.
+
+    def test_malformed_sim_trace(self):
+        with open('example_short_log.txt') as fileobj:
+            contents = fileobj.read()
+        line = next(line for line in contents.splitlines() if 'SIM_TRACE_LOG:' in line)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.txt')
+            with open(filename, 'w') as fileobj:
+                fileobj.write(line + ',0.5\n')                 # A newer simulator, with an extra value.
+                fileobj.write(contents)
+                fileobj.write(line[:-30])                       # The last line, cut short.
+            sim_trace = pl.filename_to_sim_trace_columns(filename)
+        self.assertEqual(list(sim_trace.values('steps')), [8, 9, 10, 11, 12])
+
+    def test_join_sim_trace(self):
+        (_, statuses) = pl.filename_to_status_columns('example_short_log.txt')
+        sim_trace = pl.filename_to_sim_trace_columns('example_short_log.txt')
+
+        # The last status is the start of an episode whose sim trace line isn't in the log.
+        self.assertEqual(list(pl.match_sim_trace(statuses, sim_trace)), [1, 2, 3, -1])
+
+        joined = pl.join_sim_trace(statuses, sim_trace)
+        self.assertEqual(joined[0]['episode'], 1)
+        self.assertEqual(joined[0]['closest_waypoint'], 16)
+        self.assertEqual(joined[0]['steps'], statuses[0]['steps'])
+        self.assertEqual(joined[3]['episode'], -1)
+        self.assertFalse(joined[3]['done'])
+
+    def test_compressed_logs(self):
+        with open('example_short_log.txt', 'rb') as fileobj:
+            contents = fileobj.read()
+
+        with tempfile.TemporaryDirectory() as directory:
+            for (extension, compress) in [('.gz', gzip.compress), ('.bz2', bz2.compress)]:
+                filename = os.path.join(directory, 'log.txt' + extension)
+                with open(filename, 'wb') as fileobj:
+                    fileobj.write(compress(contents))
+
+                self.assertEqual(pl.filename_to_list_of_strings(filename),
+                                 pl.filename_to_list_of_strings('example_short_log.txt'))
+                self.assertEqual(list(pl.stream_log(filename)), list(pl.stream_log('example_short_log.txt')))
+
+    @unittest.skipIf(pl.zstandard is None, 'zstandard is not installed')
+    def test_multi_frame_zstd_log(self):
+        with open('example_short_log.txt', 'rb') as fileobj:
+            contents = fileobj.read()
+        middle = contents.index(b'\n', len(contents) // 2) + 1
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.txt.zst')
+            with open(filename, 'wb') as fileobj:
+                for part in [contents[:middle], contents[middle:]]:             # Two frames, as pzstd writes.
+                    fileobj.write(pl.zstandard.ZstdCompressor().compress(part))
+
+            self.assertEqual(pl.filename_to_list_of_strings(filename),
+                             pl.filename_to_list_of_strings('example_short_log.txt'))
+            self.assertEqual(list(pl.stream_log(filename)), list(pl.stream_log('example_short_log.txt')))
+
+    def test_scan_stream(self):
+        with open('truncated_simulation_log.txt', 'rb') as fileobj:
+            contents = fileobj.read()
+        record_types = ('TRACE_STATUS', 'TRACE_WAYPOINTS', 'SIM_TRACE_LOG')
+
+        # Small blocks, so that lines are split across many blocks.
+        scanned = list(pl.scan_stream(io.BytesIO(contents), record_types, buffer_size=1000))
+        self.assertEqual(scanned, list(pl.scan_log('truncated_simulation_log.txt', record_types)))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+# Tests of replaying logs through variants of the reward function.
+
+import batch_reward as br
+import parse_logs as pl
+import replay
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'log.txt')
+        shutil.copy('truncated_simulation_log.txt', self.filename)
+
+        # Variant B, which gives a bigger reward for going fast and straight down the middle of the track (rule 5).
+        self.variant_b = os.path.join(self.directory, 'reward_b.py')
+        with open('reward_function.py') as fileobj:
+            source = fileobj.read()
+        with open(self.variant_b, 'w') as fileobj:
+            fileobj.write(source.replace('"Very Big": 1.0,', '"Very Big": 2.0,'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        variants = ['reward_function.py', self.variant_b]
+        result = replay.replay(self.filename, variants, processes=1)
+        parallel_result = replay.replay(self.filename, variants, processes=2, rows_per_chunk=50)
+        for variant in variants:
+            np.testing.assert_array_equal(parallel_result['scores'][variant], result['scores'][variant])
+            np.testing.assert_array_equal(parallel_result['rules'][variant], result['rules'][variant])
+
+        # The baseline is scored the same as the batch reward does.
+        (waypoints, statuses) = pl.filename_to_status_columns(self.filename)
+        expected = br.batch_reward(br.batch_from_statuses(statuses, waypoints))
+        np.testing.assert_array_equal(result['scores']['reward_function.py'], expected['score'])
+        np.testing.assert_array_equal(result['rules']['reward_function.py'], expected['rule_number'])
+
+        comparison = replay.compare(result)
+        baseline = comparison['reward_function.py']
+        other = comparison[self.variant_b]
+        self.assertEqual(baseline['changed_steps'], 0)
+        self.assertEqual(other['changed_steps'], baseline['rule_counts'].get(5, 0))
+        self.assertEqual(other['rule_counts'], baseline['rule_counts'])
+        self.assertAlmostEqual(other['total_score'] - baseline['total_score'], other['changed_steps'])
+        self.assertAlmostEqual(other['return_deltas'].sum(), other['changed_steps'])
+        self.assertEqual(len(other['episode_returns']), len(result['episodes']))
+
+    def test_compare_unscored(self):
+        nan = np.nan
+        result = {'episodes': replay.ep.EpisodeIndex(range(6), np.array([0, 3]), np.arange(2)),
+                  'scores': {'a': np.array([1.0, nan, 1.0, nan, 2.0, 1.0]),
+                             'b': np.array([1.0, nan, 3.0, nan, 2.0, 1.5])},
+                  'rules': {'a': np.full(6, replay.NO_RULE), 'b': np.full(6, replay.NO_RULE)}}
+        comparison = replay.compare(result)
+
+        self.assertEqual(comparison['a']['changed_steps'], 0)
+        self.assertEqual(comparison['b']['unscored_steps'], 2)
+        self.assertEqual(comparison['b']['changed_steps'], 2)
+        self.assertAlmostEqual(comparison['b']['mean_delta'], 2.5 / 4)
+        self.assertEqual(comparison['b']['max_delta'], 2.0)
+        self.assertEqual(comparison['b']['episode_returns'].tolist(), [4.0, 3.5])
+        self.assertEqual(comparison['b']['return_deltas'].tolist(), [2.0, 0.5])
+
+    def test_episode_chunks(self):
+        index = replay.ep.EpisodeIndex(range(45), np.array([0, 10, 15, 40]), np.arange(4))
+        self.assertEqual(replay.episode_chunks(index, 12), [(0, 15), (15, 40), (40, 45)])
+
+
+if __name__ == '__main__':
+    unittest.main()
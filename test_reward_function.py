@@ -0,0 +1,251 @@
+# Tests of the reward function.
+
+import reward_function as rf
+import parse_logs as pl
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+
+# Make a params dictionary, like the one DeepRacer passes to the reward function, for each status in the parm log.
+def params_from_log(filename):
+    waypoints = [[w['x'], w['y']] for w in pl.read_waypoints(filename)]
+    output = []
+    counter = 0
+    for record_type, status in pl.stream_log(filename):
+        if record_type == 'TRACE_STATUS':
+            closest = counter % len(waypoints)
+            output.append({'all_wheels_on_track': status['all_wheels_on_track'],
+                           'x': status['x'],
+                           'y': status['y'],
+                           'distance_from_center': status['distance_from_center'],
+                           'is_left_of_center': status['is_left_of_center'],
+                           'heading': status['heading'],
+                           'progress': status['progress'],
+                           'steps': status['steps'],
+                           'speed': status['speed'],
+                           'steering_angle': status['steering_angle'],
+                           'track_width': status['track_width'],
+                           'waypoints': waypoints,
+                           'closest_waypoints': [closest, (closest + 1) % len(waypoints)]})
+            counter += 1
+    return output
+
+
+# Call the reward function for each of the parm params, returning the list of scores and everything sent to stdout.
+def run_reward_function(all_params):
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        scores = [rf.reward_function(params) for params in all_params]
+    return scores, stdout.getvalue()
+
+
+# Write parm stdout of the reward function to a log file in parm directory, the same as CloudWatch would.
+def write_log(stdout, directory):
+    filename = os.path.join(directory, 'log.txt')
+    with open(filename, 'w') as fileobj:
+        for line in stdout.splitlines():
+            fileobj.write('2019-05-18T13:37:43.440Z ' + line + '\n')         # CloudWatch adds a timestamp.
+    return filename
+
+
+class TestRewardFunction(unittest.TestCase):
+
+    def setUp(self):
+        self.params = params_from_log('truncated_simulation_log.txt')
+        self.settings = (rf.WAYPOINTS_MODE, rf.TRACE_FORMAT, rf.TRACE_BATCH_SIZE, rf.PROFILE_INTERVAL)
+        rf.track_trace = rf.TrackTrace()
+        rf.trace_writer = rf.TraceWriter()
+        rf.profiler = rf.Profiler()
+
+    def tearDown(self):
+        (rf.WAYPOINTS_MODE, rf.TRACE_FORMAT, rf.TRACE_BATCH_SIZE, rf.PROFILE_INTERVAL) = self.settings
+
+    def test_waypoints_modes(self):
+        episodes = sum(1 for params in self.params if params['steps'] == 0)
+
+        for (mode, expected) in [('every_step', len(self.params)), ('on_change', 1), ('per_episode', episodes)]:
+            rf.WAYPOINTS_MODE = mode
+            rf.track_trace = rf.TrackTrace()
+            (_, stdout) = run_reward_function(self.params)
+            self.assertEqual(stdout.count('TRACE_WAYPOINTS'), expected)
+
+    def test_log_round_trip(self):
+        rf.WAYPOINTS_MODE = 'on_change'
+        (_, stdout) = run_reward_function(self.params)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = write_log(stdout, directory)
+            all_waypoints = pl.read_all_waypoints(filename)
+            statuses = [status for (record_type, status) in pl.stream_log(filename) if record_type == 'TRACE_STATUS']
+
+        self.assertEqual(len(statuses), len(self.params))
+        for status in statuses:
+            waypoints = all_waypoints[status['track_fingerprint']]
+            self.assertEqual([[w['x'], w['y']] for w in waypoints], self.params[0]['waypoints'])
+
+    def test_trace_formats(self):
+        parsed = {}
+        for trace_format in ['text', 'compact']:
+            rf.TRACE_FORMAT = trace_format
+            rf.trace_writer = rf.TraceWriter()
+            (_, stdout) = run_reward_function(self.params)
+            rule_lines = stdout.count('TRACE_RULE')
+
+            with tempfile.TemporaryDirectory() as directory:
+                filename = write_log(stdout, directory)
+                (_, statuses) = pl.filename_to_status_columns(filename)
+                (_, parallel_statuses) = pl.filename_to_status_columns(filename, processes=3)
+            self.assertEqual(list(parallel_statuses), list(statuses))
+
+            parsed[trace_format] = list(statuses)
+            for status in parsed[trace_format]:
+                del status['timestamp']                 # The only field that isn't the same each time.
+
+        self.assertEqual(len(parsed['text']), len(self.params))
+        self.assertEqual(parsed['compact'], parsed['text'])
+        self.assertEqual(rule_lines, len(set(status['rule_number'] for status in parsed['text'])))  # 1 per rule.
+
+        rf.TRACE_FORMAT = 'off'
+        self.assertEqual(run_reward_function(self.params)[1], '')
+
+    def test_trace_batches(self):
+        rf.TRACE_BATCH_SIZE = 1
+        (_, unbatched) = run_reward_function(self.params[:10])
+
+        rf.TRACE_BATCH_SIZE = 5
+        rf.track_trace = rf.TrackTrace()
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            for params in self.params[:10]:
+                rf.reward_function(params)
+            self.assertEqual(len(rf.trace_writer.lines), 2)          # 10 statuses and 2 waypoints lines, so far.
+            rf.trace_writer.flush()
+
+        # Same lines, apart from the timestamps.
+        self.assertEqual([line.split(' ')[2:] for line in stdout.getvalue().splitlines()],
+                         [line.split(' ')[2:] for line in unbatched.splitlines()])
+
+    def test_track_geometry(self):
+        waypoints = [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]]               # A square, anticlockwise.
+        geometry = rf.TrackGeometry(waypoints)
+        self.assertEqual(geometry.headings, [0.0, 90.0, 180.0, -90.0])
+        self.assertEqual(geometry.cumulative_distance, [0.0, 1.0, 2.0, 3.0])
+        self.assertEqual(geometry.track_length, 4.0)
+        self.assertEqual(geometry.curvature, [90.0, 90.0, 90.0, 90.0])
+
+    def test_check_direction_with_geometry(self):
+        waypoints = self.params[0]['waypoints']
+        geometry = rf.TrackGeometry(waypoints)
+
+        for params in self.params:
+            for closest_waypoints in [params['closest_waypoints'], [5, 3], [len(waypoints) - 1, 0]]:
+                state = rf.Environment(dict(params, closest_waypoints=closest_waypoints))
+                with_geometry = rf.Agent(state, geometry)
+                without_geometry = rf.Agent(state)
+                with_geometry.check_direction()
+                without_geometry.check_direction()
+                self.assertEqual(with_geometry.heading_in_right_direction, without_geometry.heading_in_right_direction)
+
+    def test_rule_outcomes(self):
+        # The rules as they were first written, as a chain of ifs, where the last rule met wins.
+        def chain_of_ifs(p):
+            number = 0
+            if p['quite_near_centre_of_track'] and not p['turning_hard'] and not p['going_fast']:
+                number = 1
+            if (p['all_wheels_on_track'] and not p['quite_near_centre_of_track'] and p['going_slowly']
+                    and p['correcting_course']):
+                number = 2
+            if (p['near_centre_of_track'] and p['heading_in_right_direction'] and not p['going_straight']
+                    and not p['going_fast'] and not p['turning_hard']):
+                number = 3
+            if (p['turning_hard'] and p['quite_near_centre_of_track'] and p['heading_in_right_direction']
+                    and p['going_slowly']):
+                number = 4
+            if (p['near_centre_of_track'] and p['heading_in_right_direction'] and p['going_fast']
+                    and p['going_straight']):
+                number = 5
+            if p['going_fast'] and p['turning_hard']:
+                number = 6
+            if p['going_fast'] and not p['quite_near_centre_of_track']:
+                number = 7
+            if not p['all_wheels_on_track']:
+                number = 8
+            return number
+
+        self.assertEqual(len(rf.RULE_OUTCOMES), 2 ** len(rf.PREDICATES))
+        for (mask, (number, _, level, score)) in enumerate(rf.RULE_OUTCOMES):
+            predicates = {name: bool(mask & (1 << bit)) for (bit, name) in enumerate(rf.PREDICATES)}
+            self.assertEqual(number, chain_of_ifs(predicates))
+            self.assertEqual(score, rf.REWARD_MAP[level])
+
+    def test_compile_rules(self):
+        rules = [(0, "Default.", "Default", 0, ()),
+                 (1, "Fast.", "Big", 2, ('going_fast',)),
+                 (2, "Off track.", "Penalise", 1, ('not all_wheels_on_track',))]
+        outcomes = rf.compile_rules(rules)
+        fast = 1 << rf.PREDICATES.index('going_fast')
+        on_track = 1 << rf.PREDICATES.index('all_wheels_on_track')
+        self.assertEqual(outcomes[on_track][0], 0)
+        self.assertEqual(outcomes[0][0], 2)
+        self.assertEqual(outcomes[fast][0], 1)                  # Higher priority wins, even though it is earlier.
+
+        with self.assertRaises(ValueError):
+            rf.compile_rules([(0, "Default.", "Default", 0, ('going_sideways',))])
+        with self.assertRaises(ValueError):
+            rf.compile_rules(rules[1:])                         # Nothing is met when slow and on track.
+
+    def test_reward_engine(self):
+        rf.TRACE_FORMAT = 'off'
+        engine = rf.RewardEngine()
+        for params in self.params:
+            score = engine.reward(params)
+
+            # The same as making new objects for every call.
+            car = rf.Agent(rf.Environment(params))
+            car.check_track_position()
+            car.check_direction()
+            car.check_speed()
+            car.check_steering()
+            car.check_correcting_course()
+            reinforcement = rf.Reward(car)
+            reinforcement.reward_and_punish()
+
+            self.assertEqual(score, reinforcement.score)
+            self.assertEqual(engine.reinforcement.rule_number, reinforcement.rule_number)
+            for name in rf.Agent.__slots__[2:]:
+                self.assertEqual(getattr(engine.car, name), getattr(car, name))
+
+        for obj in [engine, engine.state, engine.car, engine.reinforcement]:
+            self.assertFalse(hasattr(obj, '__dict__'))
+
+    def test_profiling(self):
+        (unprofiled_scores, unprofiled) = run_reward_function(self.params)
+
+        rf.PROFILE_INTERVAL = 100
+        rf.track_trace = rf.TrackTrace()
+        (scores, stdout) = run_reward_function(self.params)
+        self.assertEqual(scores, unprofiled_scores)
+        self.assertEqual(stdout.count('TRACE_PROFILE'), len(self.params) // 100)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = write_log(stdout, directory)
+            profiles = pl.read_profiles(filename)
+            (_, statuses) = pl.filename_to_status_columns(filename)
+        self.assertEqual(len(statuses), len(self.params))               # Profile lines don't get in the way.
+
+        total = pl.sum_profiles(profiles)
+        self.assertEqual(total['calls'], len(profiles) * 100)
+        self.assertEqual(list(total['phases']), list(rf.PROFILE_PHASES))
+        for phase in total['phases'].values():
+            self.assertEqual(sum(phase['histogram'].values()), total['calls'])
+            self.assertGreater(phase['total_ns'], 0)
+
+        rule_numbers = statuses.values('rule_number')[:total['calls']].tolist()
+        self.assertEqual(total['rules'], {number: rule_numbers.count(number) for number in set(rule_numbers)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+# Tests of the visualisation, drawn headless so that no display is needed.
+
+import visualise_logs as vl
+import imageio
+import os
+import tempfile
+import unittest
+
+
+class TestVisualiseLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.track = vl.Track('truncated_simulation_log.txt', use_cache=False)
+        self.track.find_min_max_dimensions()
+
+    def test_headless(self):
+        screen = vl.Visualise(self.track, headless=True)
+        self.assertFalse(vl.pygame.display.get_init())                  # No window was opened.
+
+        screen.draw_all_elements(self.track.statuses[0])
+        self.assertEqual(list(screen.viewport.get_size()), screen.viewport_size)
+        self.assertEqual(screen.viewport.get_at((0, 0))[:3], screen.DARKGREEN)
+        self.assertEqual(screen.viewport.get_at((15, 45))[:3], screen.WHITE)      # Some of the speed text.
+
+        screen.animate()                                                # Returns once every status is drawn.
+        self.assertEqual(screen.speed_count, len(self.track.statuses))
+
+    def test_needs_dimensions(self):
+        with self.assertRaises(ValueError):
+            vl.Visualise(vl.Track('truncated_simulation_log.txt', use_cache=False), headless=True)
+
+    def test_make_gif(self):
+        directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_directory:
+            os.chdir(temp_directory)
+            try:
+                os.mkdir('screenshots')
+                vl.Visualise(self.track, headless=True).make_gif('test', 'test.gif', first=1, last=11)
+                frames = imageio.v3.imread(os.path.join('screenshots', 'test.gif'), index=None)
+                self.assertEqual(frames.shape, (10, 600, 800, 3))
+                self.assertTrue(os.path.exists(os.path.join('screenshots', 'test10.png')))
+                self.assertFalse(os.path.exists(os.path.join('screenshots', 'test11.png')))
+            finally:
+                os.chdir(directory)
+
+    def test_export(self):
+        screen = vl.Visualise(self.track, headless=True)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'episode.gif')
+            number = self.track.episodes.numbers[1]
+            frames = screen.export(filename, episode=number, stride=3, size=[400, 300])
+
+            length = len(self.track.episodes.episode(number))
+            self.assertEqual(frames, (length + 2) // 3)
+            self.assertEqual(imageio.v3.imread(filename, index=None).shape, (frames, 300, 400, 3))
+
+        # Unscaled frames are the viewport's pixels.
+        screen.draw_all_elements(self.track.statuses[0])
+        pixels = screen.frame_pixels()
+        self.assertEqual(pixels.shape, (600, 800, 3))
+        self.assertEqual(tuple(pixels[0, 0]), screen.DARKGREEN)
+
+    def test_episode_needs_columns(self):
+        number = self.track.episodes.numbers[1]
+        self.assertEqual(list(self.track.episode(number)), list(self.track.episodes.episode(number)))
+
+        track = vl.Track('truncated_simulation_log.txt', storage='list')
+        track.find_min_max_dimensions()
+        screen = vl.Visualise(track, headless=True)
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(ValueError):
+                screen.export(os.path.join(directory, 'episode.gif'), episode=number)
+        with self.assertRaises(ValueError):
+            screen.animate(episode=number)
+
+    def test_export_parallel(self):
+        with tempfile.TemporaryDirectory() as directory:
+            serial_filename = os.path.join(directory, 'serial.gif')
+            parallel_filename = os.path.join(directory, 'parallel.gif')
+            frames_in_flight = vl.FRAMES_IN_FLIGHT
+            try:
+                # The 2nd time, FRAMES_IN_FLIGHT only holds 2 tasks, so is raised to a task for each of 3 processes.
+                for (show_reward_info, size, limit) in [(False, None, frames_in_flight), (True, [400, 300], 8)]:
+                    vl.FRAMES_IN_FLIGHT = limit
+                    serial = vl.Visualise(self.track, headless=True)
+                    parallel = vl.Visualise(self.track, headless=True)
+                    serial.show_reward_info = parallel.show_reward_info = show_reward_info
+
+                    statuses = self.track.statuses[:60]
+                    frames = serial.export(serial_filename, statuses, stride=2, size=size)
+                    self.assertEqual(parallel.export_parallel(parallel_filename, statuses, stride=2, size=size,
+                                                              processes=3, frames_per_task=4), frames)
+                    self.assertTrue((imageio.v3.imread(parallel_filename, index=None)
+                                     == imageio.v3.imread(serial_filename, index=None)).all())
+                    self.assertEqual(parallel.overlay_state(), serial.overlay_state())
+            finally:
+                vl.FRAMES_IN_FLIGHT = frames_in_flight
+
+    def test_car_edges_on_track(self):
+        statuses = self.track.statuses[:20]
+        cars = vl.car_edges_on_track(statuses.values('x'), statuses.values('y'), statuses.values('heading'),
+                                     statuses.values('steering_angle'))
+        self.assertEqual(cars.shape, (20, len(vl.CAR_EDGES), 2, 2))
+        for (s, car) in zip(statuses, cars):
+            [one_car] = vl.car_edges_on_track(s['x'], s['y'], s['heading'], s['steering_angle'])
+            self.assertEqual(one_car.tolist(), car.tolist())
+
+    def test_draw_changed_elements(self):
+        full = vl.Visualise(self.track, headless=True)
+        incremental = vl.Visualise(self.track, headless=True)
+        for (i, s) in enumerate(self.track.statuses[:80]):
+            if i == 40:
+                full.show_reward_info = incremental.show_reward_info = True
+            full.draw_all_elements(s)
+            rects = incremental.draw_changed_elements(s)
+            if i in [0, 40]:
+                self.assertEqual(rects, [incremental.viewport.get_rect()])     # Everything, after a change of view.
+            else:
+                self.assertLess(sum(r.width * r.height for r in rects), 800 * 600 / 4)
+            self.assertEqual(vl.pygame.image.tobytes(incremental.viewport, 'RGB'),
+                             vl.pygame.image.tobytes(full.viewport, 'RGB'))
+        self.assertEqual(incremental.overlay_state(), full.overlay_state())
+
+    def test_text_cache(self):
+        screen = vl.Visualise(self.track, headless=True)
+        surface = screen.render_text(screen.myfont, 'Steps = 1.0', screen.WHITE)
+        self.assertIs(screen.render_text(screen.myfont, 'Steps = 1.0', screen.WHITE), surface)
+        self.assertIsNot(screen.render_text(screen.myfont, 'Steps = 1.0', screen.PINK), surface)
+
+        cache_size = vl.TEXT_CACHE_SIZE
+        vl.TEXT_CACHE_SIZE = 40
+        try:
+            for s in self.track.statuses[:50]:
+                screen.draw_all_elements(s)
+                self.assertLessEqual(len(screen.text_cache), 40)
+        finally:
+            vl.TEXT_CACHE_SIZE = cache_size
+        label = (screen.mysmallfont, 'ENTER to Start Again', tuple(screen.WHITE))
+        self.assertIn(label, screen.text_cache)                         # Used every frame, so never dropped.
+        self.assertNotIn((screen.myfont, 'Steps = 1.0', tuple(screen.PINK)), screen.text_cache)
+
+    def test_viewport_projection(self):
+        screen = vl.Visualise(self.track, headless=True)
+        statuses = self.track.statuses
+        coords = [[x, y] for (x, y) in zip(statuses.values('x').tolist(), statuses.values('y').tolist())]
+        coords += [[-0.37, -1.9], [0.0, 0.0]]                           # Negative ones round towards zero too.
+
+        for (projection, border) in [(screen.projection, 1), (screen.unbordered_projection, 0)]:
+            pixels = projection.project(coords)
+            self.assertEqual(pixels.shape, (len(coords), 2))
+            self.assertEqual(pixels.tolist(), [screen.track_to_viewport(c, border) for c in coords])
+
+        edges = vl.car_edges_on_track(statuses.values('x'), statuses.values('y'), statuses.values('heading'),
+                                      statuses.values('steering_angle'))
+        self.assertEqual(screen.projection.project(edges).shape, edges.shape)
+        self.assertEqual(len(screen.waypoint_pixels), len(self.track.waypoints))
+
+
+if __name__ == '__main__':
+    unittest.main()
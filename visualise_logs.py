@@ -1,10 +1,17 @@
 # Do a visualisation of DeepRacer logs.
 
 import parse_logs as pl
+import log_cache as lc
+import episodes as ep
 import cartesian_coordinates as cc
 import pygame                           # 2d games engine.
 import imageio                          # For making animated GIFs.
 import math
+import itertools
+import collections
+import multiprocessing
+import queue
+import numpy as np
 import pygame.gfxdraw
 
 
@@ -15,9 +22,130 @@ def dict_coord_to_list(dict_coord):
     list_coord.append(dict_coord['y'])
     return list_coord
 
+
+FRAMES_PER_TASK = 25                    # Frames drawn by a worker process at a time, by Visualise.export_parallel().
+FRAMES_IN_FLIGHT = 200                  # Most frames drawn but not yet written at once, unless there are more workers.
+WORKER_POLL_SECONDS = 1.0               # How often export_parallel() checks that its workers are still running.
+
+# Vertices of the car, when it is at the origin and heading along the x axis.
+CAR_VERTICES = np.array([[-2.0, 0.0],           # 0 tail
+                         [2.5, 0.0],            # 1 nose
+                         [-2.0, -1.0],          # 2 bl_hub
+                         [-3.0, -1.0],          # 3 bl_tyre1
+                         [-1.0, -1.0],          # 4 bl_tyre2
+                         [2.0, -1.0],           # 5 fl_hub
+                         [1.0, -1.0],           # 6 fl_tyre1
+                         [3.0, -1.0],           # 7 fl_tyre2
+                         [-2.0, 1.0],           # 8 br_hub
+                         [-3.0, 1.0],           # 9 br_tyre1
+                         [-1.0, 1.0],           # 10 br_tyre2
+                         [2.0, 1.0],            # 11 fr_hub
+                         [1.0, 1.0],            # 12 fr_tyre1
+                         [3.0, 1.0]])           # 13 fr_tyre2
+
+# Pairs of CAR_VERTICES that lines are drawn between; tail to nose, the axles and the tyres.
+CAR_EDGES = np.array([(0, 1), (2, 8), (5, 11), (3, 4), (6, 7), (9, 10), (12, 13)])
+
+# The front tyres, which turn with the steering, as ([vertices of the tyre], vertex of the hub it turns around).
+FRONT_TYRES = [([6, 7], 5), ([12, 13], 11)]
+
+CAR_SCALE = 0.07                        # Tracks coordinate scale is tiny!
+CAR_LINE_WIDTH = 5
+
+# Labels of the info box, each (text, status field that colours it, position of the text, position of the pie chart,
+# counter shown by the pie chart). The Going Straight pie has always shown the turning hard counter.
+INFO_BOX_LABELS = [('Near Centre Of Track', 'near_centre_of_track', (10, 500), (400, 510), 'NCOT'),
+                   ('Quite Near Centre Of Track', 'quite_near_centre_of_track', (10, 525), (400, 535), 'QNCOT'),
+                   ('Heading In Right Direction', 'heading_in_right_direction', (10, 550), (400, 560), 'HIRD'),
+                   ('Turning Hard', 'turning_hard', (10, 575), (400, 585), 'TH'),
+                   ('Going Straight', 'going_straight', (500, 500), (730, 510), 'TH'),
+                   ('Going Fast', 'going_fast', (500, 525), (730, 535), 'GF'),
+                   ('Going Slowly', 'going_slowly', (500, 550), (730, 560), 'GSL'),
+                   ('Correcting Course', 'correcting_course', (500, 575), (730, 585), 'CC')]
+PIE_RADIUS = 10
+TEXT_CACHE_SIZE = 1024                  # Rendered text surfaces kept by Visualise.render_text().
+
+# Counters of Visualise that build up from one status to the next.
+OVERLAY_COUNTERS = ('NCOT', 'QNCOT', 'HIRD', 'TH', 'GS', 'GF', 'GSL', 'CC', 'speed_count', 'GRWD', 'BRWD', 'OKRWD',
+                    'SMRWD')
+
+
+# Work out where the edges of the car are on the track, for parm x, y, heading and steering angle, which may be arrays
+# for many cars at once. Returns an array of shape (cars, edges, 2, 2), the [x, y] of both ends of each edge.
+def car_edges_on_track(x, y, heading, steering_angle):
+    heading = np.atleast_1d(np.asarray(heading, dtype=np.float64))
+    steering_angle = np.atleast_1d(np.asarray(steering_angle, dtype=np.float64))
+    car_coords = np.stack([np.atleast_1d(x), np.atleast_1d(y)], axis=-1)
+
+    vertices = np.broadcast_to(CAR_VERTICES, (len(heading),) + CAR_VERTICES.shape)
+    vertices = cc.batch_rotate_around_origin(vertices, - heading)
+    vertices = cc.batch_scale(vertices, CAR_SCALE)
+    vertices = cc.batch_translation(vertices, car_coords)       # Move the vertices to the car's coord on track.
+
+    # The front tyres are rotated around their hubs by the steering angle.
+    for (tyre, hub) in FRONT_TYRES:
+        vertices[:, tyre] = cc.batch_rotate_around_a_point(vertices[:, tyre], vertices[:, hub], - steering_angle)
+
+    return vertices[:, CAR_EDGES]
+
+
+# Merge those of parm rects that overlap each other, so that no area is drawn twice. Returns a list of pygame.Rect.
+def merge_rects(rects):
+    output = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        merged = True
+        while merged:
+            merged = False
+            for (i, other) in enumerate(output):
+                if rect.colliderect(other):
+                    rect.union_ip(output.pop(i))
+                    merged = True
+                    break
+        output.append(rect)
+    return output
+
+
+# Projects coordinates in track coordinate space into viewport coordinate space, for a track whose dimensions are
+# parm bounds, (min_x, max_x, min_y, max_y), drawn on a viewport of parm viewport_size with parm border pixels around
+# it. The coefficients are worked out once, so projecting is just arithmetic, and whole arrays of coordinates can be
+# projected at a time.
+class ViewportProjection:
+
+    def __init__(self, bounds, viewport_size, border):
+        (min_x, max_x, min_y, max_y) = bounds
+        self.border = border
+        self.height = viewport_size[1]
+        self.x_space = viewport_size[0] - 2 * border    # Amount of space on x dim that can be rendered to.
+        self.y_space = viewport_size[1] - 2 * border    # Amount of space on y dim that can be rendered to.
+        self.x_range = max_x - min_x
+        self.y_range = max_y - min_y
+
+    # Project a single parm [x, y] coordinate. Returns [x, y] of ints.
+    def point(self, t_coords):
+        [track_x, track_y] = t_coords
+        return [self.border + int(track_x * self.x_space / self.x_range),
+                self.height - int(track_y * self.y_space / self.y_range) - self.border]
+
+    # Project parm coords, an array of any shape whose last dimension is [x, y], in one go. Returns an int array of
+    # the same shape. Rounds the same way as point() does, towards zero, so that both give the same pixels.
+    def project(self, coords):
+        coords = np.asarray(coords, dtype=np.float64)
+        output = np.empty(coords.shape, dtype=np.int64)
+        output[..., 0] = self.border + np.trunc(coords[..., 0] * self.x_space / self.x_range)
+        output[..., 1] = self.height - np.trunc(coords[..., 1] * self.y_space / self.y_range) - self.border
+        return output
+
+
 class Track:
 
-    def __init__(self, filename):
+    # storage says how the statuses are held,
+    # 'columns' - In a compact parse_logs.StatusColumns. If use_cache is True, this is loaded from the log_cache if the
+    #             cache is fresh, otherwise it is parsed from the log file, by parm number of processes, and then
+    #             cached.
+    # 'list'    - As a list of status dictionaries.
+    # 'stream'  - Not held in memory at all, but streamed from the log file each time that they are needed.
+    def __init__(self, filename, storage='columns', use_cache=True, processes=1):
 
         big_float = 100000.0
 
@@ -27,14 +155,38 @@ class Track:
         self.min_y = big_float
         self.max_y = -big_float
 
-        logs = pl.filename_to_list_of_strings(filename)
-        waypoints_only = pl.filter_by_2nd_item(logs, 'TRACE_WAYPOINTS')
-        statuses_only = pl.filter_by_2nd_item(logs, 'TRACE_STATUS')
+        if storage == 'columns':
+            if use_cache:
+                self.waypoints, self.statuses = lc.load_status_columns(filename, processes)
+            else:
+                self.waypoints, self.statuses = pl.filename_to_status_columns(filename, processes)
+        elif storage == 'stream':
+            self.waypoints = pl.read_waypoints(filename)
+            self.statuses = pl.StatusStream(filename)
+        elif storage == 'list':
+            self.waypoints = []
+            self.statuses = []
+            for record_type, record in pl.stream_log(filename):     # Single pass through the log file.
+                if record_type == 'TRACE_STATUS':
+                    self.statuses.append(record)
+                elif not self.waypoints:
+                    self.waypoints = record
+        else:
+            raise ValueError('Unknown storage: ' + storage)
+
+        # Index of where each episode starts and ends. Only available for 'columns' storage.
+        if isinstance(self.statuses, pl.StatusColumns):
+            self.episodes = ep.EpisodeIndex.from_statuses(self.statuses)
+        else:
+            self.episodes = None
 
-        self.waypoints = pl.make_list_of_waypoints(waypoints_only)
-        self.statuses = pl.make_list_of_statuses(statuses_only)
+        self.start_time = next(iter(self.statuses))['timestamp']
 
-        self.start_time = (self.statuses[0])['timestamp']
+    # Return the statuses of the parm episode number. Episodes can only be picked out of 'columns' storage.
+    def episode(self, number):
+        if self.episodes is None:
+            raise ValueError('Picking out an episode needs columns storage')
+        return self.episodes.episode(number)
 
     def find_min_max_dimensions(self):
         # First look for min and max in waypoints list.
@@ -49,6 +201,14 @@ class Track:
                 self.max_y = w['y']
 
         # Now look for min and max in statuses list.
+        if isinstance(self.statuses, pl.StatusColumns):
+            if len(self.statuses) > 0:                      # Whole columns at a time.
+                self.min_x = min(self.min_x, float(self.statuses.values('x').min()))
+                self.max_x = max(self.max_x, float(self.statuses.values('x').max()))
+                self.min_y = min(self.min_y, float(self.statuses.values('y').min()))
+                self.max_y = max(self.max_y, float(self.statuses.values('y').max()))
+            return
+
         for s in self.statuses:
             if s['x'] < self.min_x:
                 self.min_x = s['x']
@@ -62,10 +222,16 @@ class Track:
 
 class Visualise:
 
-    def __init__(self, track):
+    # If headless is True, everything is drawn to an offscreen surface rather than a window, so no display is needed,
+    # and animate() draws the frames as fast as it can, without waiting for events.
+    def __init__(self, track, headless=False):
 
-        # Initialize the game engine.
-        pygame.init()
+        # Initialize the game engine. Headless only needs the fonts.
+        self.headless = headless
+        if headless:
+            pygame.font.init()
+        else:
+            pygame.init()
 
         self.track = track
 
@@ -91,14 +257,27 @@ class Visualise:
         self.viewport_size = [800, 600]
         self.border = 100                        # Number of pixels border around track & car.
 
-        self.viewport = pygame.display.set_mode(self.viewport_size)
+        # Projections from track coordinates to the viewport, with and without the border, and the waypoints projected
+        # with the border, once and for all. So the bounds of the track must already be known.
+        if track.min_x > track.max_x:
+            raise ValueError('Call find_min_max_dimensions() on the track before visualising it')
+        bounds = (track.min_x, track.max_x, track.min_y, track.max_y)
+        self.projection = ViewportProjection(bounds, self.viewport_size, self.border)
+        self.unbordered_projection = ViewportProjection(bounds, self.viewport_size, 0)
+        self.waypoint_pixels = self.projection.project([dict_coord_to_list(w) for w in track.waypoints]).tolist()
+
+        if headless:
+            self.viewport = pygame.Surface(self.viewport_size)
+        else:
+            self.viewport = pygame.display.set_mode(self.viewport_size)
 
         pygame.font.init()  # you have to call this at the start,
         # if you want to use this module.
         self.myfont = pygame.font.SysFont('Courier New', 20)
         self.mysmallfont = pygame.font.SysFont('Courier New', 15)
 
-        pygame.display.set_caption('DeepRacer Visualisation')
+        if not headless:
+            pygame.display.set_caption('DeepRacer Visualisation')
 
         # counters
         self.NCOT =0 # near center
@@ -119,11 +298,32 @@ class Visualise:
         #switching things on and off
         self.show_reward_info=0
 
+        # Rendered text, (font, text, colour) -> surface, least recently used first. The labels that never change are
+        # rendered straight away. They are used every frame, so are never the least recently used.
+        self.text_cache = collections.OrderedDict()
+        for text in ['SPACE Toggles Reward Graph View', 'ENTER to Start Again']:
+            self.render_text(self.mysmallfont, text, self.WHITE)
+        for (text, _, _, _, _) in INFO_BOX_LABELS:
+            for colour in [self.BLUE, self.PINK]:
+                self.render_text(self.myfont, text, colour)
+
+        # What is on the viewport from the last frame, for draw_changed_elements(), as (rect of the car, info box items,
+        # rects of the info box items, rects that the overlays changed after they were drawn, show_reward_info). None if
+        # the whole viewport needs to be drawn again.
+        self.drawn = None
+
         #graph surfaces
         self.grp = pygame.Surface([700,50], pygame.SRCALPHA, 32) #speed graph at top of screen
-        self.grp = self.grp.convert_alpha()
+        self.grp = self.convert_alpha(self.grp)
         self.rwd = pygame.Surface([800,600], pygame.SRCALPHA, 32) #reward overlay graph
-        self.rwd = self.rwd.convert_alpha()
+        self.rwd = self.convert_alpha(self.rwd)
+
+    # Convert parm surface to the pixel format of the display, for quicker blits. Headless there is no display, and the
+    # surfaces already have per pixel alpha, so they are left as they are.
+    def convert_alpha(self, surface):
+        if self.headless:
+            return surface
+        return surface.convert_alpha()
 
     def bool_to_colour(self, truth):
         if truth:
@@ -133,21 +333,9 @@ class Visualise:
 
     # Function to convert parm coords in track coordinate space into viewport coordinate space.
     def track_to_viewport(self, t_coords, should_add_border):
-        [track_x, track_y] = t_coords
-
-        border=0
-
         if should_add_border:
-             border=self.border
-
-        vp_x_space = self.viewport_size[0] - 2 * border    # Amount of space on x dim that can be rendered to.
-        vp_x = border + int(track_x * vp_x_space / (self.track.max_x - self.track.min_x))
-
-        vp_y_space = self.viewport_size[1] - 2 * border    # Amount of space on y dim that can be rendered to.
-        vp_y = self.viewport_size[1] - int(track_y * vp_y_space / (self.track.max_y - self.track.min_y)) - border
-
-        return [vp_x, vp_y]
-   
+            return self.projection.point(t_coords)
+        return self.unbordered_projection.point(t_coords)
 
     def draw_track(self):
         
@@ -155,35 +343,32 @@ class Visualise:
         # no need to draw everything again
             self.viewport.blit(self.rendered_track, [0,0])
             return
-        prev = self.track.waypoints[-1]             # Initialise previous to last waypoint.
+        pixels = self.waypoint_pixels
+        prev = pixels[-1]                           # Initialise previous to last waypoint.
         tw=self.track_to_viewport([self.track.max_x,self.track.min_y],0)
         
     # need transparent surface
         img = pygame.Surface(tw, pygame.SRCALPHA, 32)
-        img = img.convert_alpha()
+        img = self.convert_alpha(img)
 
     # draw track limits in white using circles, perfect pi distances for width - no scaling required and you could have varable widths if needed
-        for wp in self.track.waypoints:
-            line_from = dict_coord_to_list(prev)
-            pygame.draw.circle(img, self.WHITE, self.track_to_viewport(line_from, 1), int((self.track_width/2)+4))
-            #pygame.gfxdraw.aacircle(img, self.track_to_viewport(line_from,1)[0], self.track_to_viewport(line_from,1)[1], (self.track_width/2)+8, self.WHITE)
+        for wp in pixels:
+            pygame.draw.circle(img, self.WHITE, prev, int((self.track_width/2)+4))
+            #pygame.gfxdraw.aacircle(img, prev[0], prev[1], (self.track_width/2)+8, self.WHITE)
             prev = wp
     # as above, but this time overlay track in blackish
-        for wp in self.track.waypoints:
-            line_from = dict_coord_to_list(prev)
+        for wp in pixels:
             # draw track over outer limits
-            pygame.draw.circle(img, self.BLACK, self.track_to_viewport(line_from,1), int(self.track_width/2))
+            pygame.draw.circle(img, self.BLACK, prev, int(self.track_width/2))
             prev = wp
     # Finally draw center lines at intervals of waypoints/80 dashes
         count=0
         paint=0
-        for wp in self.track.waypoints:
-            line_from = dict_coord_to_list(prev)
-            line_to = dict_coord_to_list(wp)
+        for wp in pixels:
             count+=1
             # draw some dashed lines if in painting mode
-            if count>=len(self.track.waypoints)/50 and paint<=len(self.track.waypoints)/80:
-                pygame.draw.line(img, self.YELLOW, self.track_to_viewport(line_from,1), self.track_to_viewport(line_to,1), 6)
+            if count>=len(pixels)/50 and paint<=len(pixels)/80:
+                pygame.draw.line(img, self.YELLOW, prev, wp, 6)
                 paint+=1
 
                 if (paint>=len(self.track.waypoints)/80):
@@ -196,124 +381,69 @@ class Visualise:
       
        # never do all that again
         self.trackdrawn=1
+        self.viewport.blit(self.rendered_track, [0,0])
+
+    # Return the colour of the car for parm state, and the viewport [[x, y], [x, y]] of each of its edges.
+    def car_lines(self, state):
+        colour = self.bool_to_colour(state['all_wheels_on_track'])
+        [edges] = car_edges_on_track(state['x'], state['y'], state['heading'], state['steering_angle'])
+        return (colour, self.projection.project(edges).tolist())
+
+    # Return a rect that the car's parm lines, as made by car_lines(), are all drawn inside.
+    def car_rect(self, lines):
+        xs = [x for line in lines for (x, _) in line]
+        ys = [y for line in lines for (_, y) in line]
+        rect = pygame.Rect(min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+        return rect.inflate(2 * CAR_LINE_WIDTH, 2 * CAR_LINE_WIDTH)
 
     def draw_car(self, state):
-        car_vertices = {'tail': [-2.0, 0.0],
-                        'nose': [2.5, 0.0],
-                        'bl_hub': [-2.0, -1.0],
-                        'bl_tyre1': [-3.0, -1.0],
-                        'bl_tyre2': [-1.0, -1.0],
-                        'fl_hub': [2.0, -1.0],
-                        'fl_tyre1': [1.0, -1.0],
-                        'fl_tyre2': [3.0, -1.0],
-                        'br_hub': [-2.0, 1.0],
-                        'br_tyre1': [-3.0, 1.0],
-                        'br_tyre2': [-1.0, 1.0],
-                        'fr_hub': [2.0, 1.0],
-                        'fr_tyre1': [1.0, 1.0],
-                        'fr_tyre2': [3.0, 1.0]}
-
-        car_edges = [('tail', 'nose'),
-                     ('bl_hub', 'br_hub'),
-                     ('fl_hub', 'fr_hub'),
-                     ('bl_tyre1', 'bl_tyre2'),
-                     ('fl_tyre1', 'fl_tyre2'),
-                     ('br_tyre1', 'br_tyre2'),
-                     ('fr_tyre1', 'fr_tyre2')]
-
-        car_coord = dict_coord_to_list(state)
-
-        new_vertices = {}
-
-        #get hub position
-        fl_hub_vertex=None
-        fr_hub_vertex=None
-        for key in car_vertices:
-            if key in ['fl_hub', 'fr_hub']:
-                val = car_vertices[key]
-                rotated = cc.rotate_around_origin(val, - state['heading'])
-                scaled = cc.scale(rotated, 0.07)                         # Tracks coordinate scale is tiny!
-                translated = cc.translation(scaled, car_coord)          # Move the vertex to the car's coord on track.
-                # The front hub positions will be needed later, for rotating front tyres around,
-                # so set variables to remember them.
-                if key == 'fl_hub':
-                    fl_hub_vertex = translated
-                elif key == 'fr_hub':
-                    fr_hub_vertex = translated
-
-        for key in car_vertices:
-            val = car_vertices[key]
-
-            rotated = cc.rotate_around_origin(val, - state['heading'])
-
-            scaled = cc.scale(rotated, 0.07)                         # Tracks coordinate scale is tiny!
-            translated = cc.translation(scaled, car_coord)          # Move the vertex to the car's coord on track.
-
-            # If this vertex is part of a front tyre, then it needs to be rotated around it's hub.
-            if key in ['fl_tyre1', 'fl_tyre2']:
-                translated = cc.rotate_around_a_point(translated, fl_hub_vertex, - state['steering_angle'])
-            elif key in ['fr_tyre1', 'fr_tyre2']:
-                translated = cc.rotate_around_a_point(translated, fr_hub_vertex, - state['steering_angle'])
-
-            new_vertices[key] = translated
-
-        for (k1, k2) in car_edges:
-            v1 = new_vertices[k1]
-            v2 = new_vertices[k2]
-
-            pygame.draw.line(
-                self.viewport,
-                self.bool_to_colour(state['all_wheels_on_track']),
-                self.track_to_viewport(v1,1),
-                self.track_to_viewport(v2,1),5)
-    
+        (colour, lines) = self.car_lines(state)
+        for (v1, v2) in lines:
+            pygame.draw.line(self.viewport, colour, v1, v2, CAR_LINE_WIDTH)
 
-        #show rewards based on speed and reward strength
+    # Return the colour that parm score is shown in, and the name of the counter that it is counted in.
+    def reward_colour(self, score):
+        if score<0.5 and score>0:
+           return (self.LIGHTORANGE, 'SMRWD')
+        elif score>0.5 and score<1:
+           return (self.ORANGE, 'OKRWD')
+        elif score<0:
+           return (self.RED, 'BRWD')
+        else:
+           return (self.LIGHTGREEN, 'GRWD')
 
-    def show_rewards(self, state):
+    # Add the parm state's reward to the reward overlay, once it has been counted by count_state(). Returns the rects
+    # of the overlay that changed.
+    def update_rewards(self, state):
 
 
-        car = dict_coord_to_list(state)
-        carposX=self.track_to_viewport(car,1)[0];
-        carposY=self.track_to_viewport(car,1)[1];
+        [carposX, carposY] = self.projection.point(dict_coord_to_list(state))
 
         size=20
         
-        score=state['score']
-        if score<0.5 and score>0:
-           reward_color=self.LIGHTORANGE
-           self.SMRWD+=1
-
-        elif score>0.5 and score<1:
-           reward_color=self.ORANGE
-           self.OKRWD+=1
-
-        elif score<0:
-           reward_color=self.RED
-           self.BRWD+=1    	
-        else:
-           reward_color=self.LIGHTGREEN
-           self.GRWD+=1
+        (reward_color, _) = self.reward_colour(state['score'])
         new_positions=self.rotate_line([ [carposX,carposY], [carposX,carposY+int((abs(state['score'])*(state['speed']*2+size))) ]], state['heading'])
-        pygame.draw.line(self.rwd, reward_color, new_positions[0],new_positions[1] , 8)
-        pygame.draw.circle(self.rwd,self.WHITE,[carposX,carposY],5) #racing line
-        pygame.draw.circle(self.rwd,reward_color,new_positions[1],5) #endcap for dodgy bar
+        changed = [pygame.draw.line(self.rwd, reward_color, new_positions[0],new_positions[1] , 8),
+                   pygame.draw.circle(self.rwd,self.WHITE,[carposX,carposY],5), #racing line
+                   pygame.draw.circle(self.rwd,reward_color,new_positions[1],5)] #endcap for dodgy bar
         
         # draw simple rewards TTD
         if self.GRWD>0:  
-            pygame.draw.line(self.rwd, self.LIGHTGREEN, [200,290],[200+int(self.GRWD*2),290] , 20)
-        self.draw_small_text('Good: '+str(self.GRWD), 210, 280, self.BLACK)
+            changed.append(pygame.draw.line(self.rwd, self.LIGHTGREEN, [200,290],[200+int(self.GRWD*2),290] , 20))
         if self.OKRWD>0:
-            pygame.draw.line(self.rwd, self.ORANGE, [200,270],[200+int(self.OKRWD*2),270] , 20)
-        self.draw_small_text('Okay: '+str(self.OKRWD), 210, 260, self.BLACK)
+            changed.append(pygame.draw.line(self.rwd, self.ORANGE, [200,270],[200+int(self.OKRWD*2),270] , 20))
         if self.SMRWD>0:
-            pygame.draw.line(self.rwd, self.LIGHTORANGE, [200,250],[200+int(self.SMRWD*2),250] , 20)
-        self.draw_small_text('Small: '+str(self.SMRWD), 210, 240, self.BLACK)
+            changed.append(pygame.draw.line(self.rwd, self.LIGHTORANGE, [200,250],[200+int(self.SMRWD*2),250] , 20))
         if self.BRWD>0:
-            pygame.draw.line(self.rwd, self.RED, [200,230],[200+int(self.BRWD*2),230] , 20)
-        self.draw_small_text('Bad Car: '+str(self.BRWD), 210, 220, self.BLACK)
-
+            changed.append(pygame.draw.line(self.rwd, self.RED, [200,230],[200+int(self.BRWD*2),230] , 20))
+        return changed
 
+    # Items of the reward counts, see info_box_items().
+    def reward_items(self):
+        return [('text', self.mysmallfont, 'Good: '+str(self.GRWD), self.BLACK, (210, 280)),
+                ('text', self.mysmallfont, 'Okay: '+str(self.OKRWD), self.BLACK, (210, 260)),
+                ('text', self.mysmallfont, 'Small: '+str(self.SMRWD), self.BLACK, (210, 240)),
+                ('text', self.mysmallfont, 'Bad Car: '+str(self.BRWD), self.BLACK, (210, 220))]
 
     def rotate_line(self,line, deg):
    
@@ -341,60 +471,127 @@ class Visualise:
        
         return[[int(p1x), int(p1y)], [int(p2x), int(p2y)]]
 
-    def draw_text(self, text, x, y, colour):
-        textsurface = self.myfont.render(text, False, colour)
-        self.viewport.blit(textsurface, (x, y))
-    def draw_small_text(self, text, x, y, colour):
-        textsurface = self.mysmallfont.render(text, False, colour)
-        self.viewport.blit(textsurface, (x, y))
-
-    def draw_info_box(self, state):
-        self.draw_small_text('SPACE Toggles Reward Graph View', 200, 300, self.WHITE)
-        self.draw_small_text('ENTER to Start Again', 200, 320, self.WHITE)
-        self.draw_text('Speed = ' + str(state['speed']), 10, 10, self.WHITE)
-        self.draw_speed_graph(state['speed'])
-        self.draw_text('Steps = ' + str(state['steps']), 10, 35, self.WHITE)
-        self.draw_text('Reward = ' + str(state['score']), 10, 60, self.WHITE)
+    # Return a surface of parm text in parm font and colour. Most text is the same from one frame to the next, or has
+    # been seen before (the speeds, steps and scores come from a small set of values), so the surfaces are cached, up
+    # to TEXT_CACHE_SIZE of them.
+    def render_text(self, font, text, colour):
+        key = (font, text, tuple(colour))
+        surface = self.text_cache.get(key)
+        if surface is None:
+            surface = font.render(text, False, colour)
+            self.text_cache[key] = surface
+            if len(self.text_cache) > TEXT_CACHE_SIZE:
+                self.text_cache.popitem(last=False)
+        else:
+            self.text_cache.move_to_end(key)
+        return surface
 
-        #show rewards along the way, should be elsewhere but hey!
-        self.show_rewards(state)
+    def draw_text(self, text, x, y, colour):
+        return self.viewport.blit(self.render_text(self.myfont, text, colour), (x, y))
+
+    # Add the parm state to everything that builds up from one status to the next; the counters, the speed graph and
+    # the reward overlay. The counters in each frame include its own state, but the speed graph and reward overlay are
+    # drawn before they are added to, so only show up to the state before. Returns the rects of the viewport that the
+    # speed graph and, if it is shown, the reward overlay changed.
+    def advance(self, state):
+        self.count_state(state)
+        return self.draw_overlays(state)
+
+    # Add the parm state to the speed graph and the reward overlay. Returns the rects of the viewport that changed.
+    def draw_overlays(self, state):
+        changed = [self.draw_speed_graph(state['speed']).move(60, -20)]
+        reward_changed = self.update_rewards(state)
+        if self.show_reward_info:
+            changed += reward_changed
+        return changed
 
-        self.draw_text('Near Centre Of Track', 10, 500, self.bool_to_colour(state['near_centre_of_track']))
+    # Add the parm state to the counters.
+    def count_state(self, state):
+        (_, counter) = self.reward_colour(state['score'])
+        setattr(self, counter, getattr(self, counter) + 1)
         if not state['near_centre_of_track']:
             self.NCOT+=1
-        self.draw_pie(400,510,self.NCOT,10)
-        self.draw_text('Quite Near Centre Of Track', 10, 525, self.bool_to_colour(state['quite_near_centre_of_track']))
         if not state['quite_near_centre_of_track']:
             self.QNCOT+=1
-        self.draw_pie(400,535,self.QNCOT,10)
-        self.draw_text('Heading In Right Direction', 10, 550, self.bool_to_colour(state['heading_in_right_direction']))
         if not state['heading_in_right_direction']:
             self.HIRD+=1
-        self.draw_pie(400,560,self.HIRD,10)
-        self.draw_text('Turning Hard', 10, 575, self.bool_to_colour(state['turning_hard']))
         if not state['turning_hard']:
             self.TH+=1
-        self.draw_pie(400,585,self.TH,10)
-        self.draw_text('Going Straight', 500, 500, self.bool_to_colour(state['going_straight']))
         if not state['going_straight']:
             self.GS+=1
-        self.draw_pie(730,510,self.TH,10)
-        self.draw_text('Going Fast', 500, 525, self.bool_to_colour(state['going_fast']))
         if not state['going_fast']:
             self.GF+=1
-        self.draw_pie(730,535,self.GF,10)
-        self.draw_text('Going Slowly', 500, 550, self.bool_to_colour(state['going_slowly']))
         if not state['going_slowly']:
             self.GSL+=1
-        self.draw_pie(730,560,self.GSL,10)
-        self.draw_text('Correcting Course', 500, 575, self.bool_to_colour(state['correcting_course']))
         if not state['correcting_course']:
             self.CC+=1
-        self.draw_pie(730,585,self.CC,10)
+
+    # Start the counters, speed graph and reward overlay again from nothing.
+    def reset_overlays(self):
+        for name in OVERLAY_COUNTERS:
+            setattr(self, name, 0)
+        self.grp.fill(255)
+        self.rwd.fill(255)
+        self.drawn = None
+
+    # Return a snapshot of the counters, speed graph and reward overlay, which can be sent to another process.
+    def overlay_state(self):
+        return ({name: getattr(self, name) for name in OVERLAY_COUNTERS},
+                pygame.image.tobytes(self.grp, 'RGBA'),
+                pygame.image.tobytes(self.rwd, 'RGBA'))
+
+    # Put back the counters, speed graph and reward overlay from a parm snapshot made by overlay_state().
+    def set_overlay_state(self, overlay):
+        (counters, speed_graph, reward_overlay) = overlay
+        for (name, value) in counters.items():
+            setattr(self, name, value)
+        self.grp = self.convert_alpha(pygame.image.frombytes(speed_graph, self.grp.get_size(), 'RGBA'))
+        self.rwd = self.convert_alpha(pygame.image.frombytes(reward_overlay, self.rwd.get_size(), 'RGBA'))
+        self.drawn = None
+
+    # Return what the info box shows for parm state, in the order it is drawn, as a list of items, each either
+    # ('text', font, text, colour, position) or ('pie', position, value, radius).
+    def info_box_items(self, state):
+        items = [('text', self.mysmallfont, 'SPACE Toggles Reward Graph View', self.WHITE, (200, 300)),
+                 ('text', self.mysmallfont, 'ENTER to Start Again', self.WHITE, (200, 320)),
+                 ('text', self.myfont, 'Speed = ' + str(state['speed']), self.WHITE, (10, 10)),
+                 ('text', self.myfont, 'Steps = ' + str(state['steps']), self.WHITE, (10, 35)),
+                 ('text', self.myfont, 'Reward = ' + str(state['score']), self.WHITE, (10, 60))]
+        items += self.reward_items()
+
+        for (text, field, position, pie_position, counter) in INFO_BOX_LABELS:
+            items.append(('text', self.myfont, text, self.bool_to_colour(state[field]), position))
+            items.append(('pie', pie_position, getattr(self, counter), PIE_RADIUS))
+        return items
+
+    # Draw parm item of the info box, see info_box_items().
+    def draw_item(self, item):
+        if item[0] == 'text':
+            (_, font, text, colour, position) = item
+            self.viewport.blit(self.render_text(font, text, colour), position)
+        else:
+            (_, (posX, posY), val, r) = item
+            self.draw_pie(posX, posY, val, r)
+
+    # Return the rect of the viewport that parm item of the info box is drawn in.
+    def item_rect(self, item):
+        if item[0] == 'text':
+            (_, font, text, _, position) = item
+            return pygame.Rect(position, font.size(text))
+        (_, (cx, cy), val, r) = item
+        return pygame.Rect(cx - r, cy - r, 2 * r + 1, 2 * r + 1).union(self.item_rect(('text', self.myfont, str(val),
+                                                                                       self.PINK, (cx+12, cy-10))))
+
+    def draw_info_box(self, state):
+        self.advance(state)
+        for item in self.info_box_items(state):
+            self.draw_item(item)
         
+    # Add parm speed to the speed graph. Returns the rect of the graph's column that it went in.
     def draw_speed_graph(self,speed):
         pygame.draw.rect(self.grp, self.WHITE, pygame.Rect(100+self.speed_count, 50, 1, -speed*5))
         self.speed_count+=1
+        return pygame.Rect(100+self.speed_count-1, 0, 1, self.grp.get_height())
         
 
     def draw_pie(self,posX,posY,val,r):
@@ -434,10 +631,60 @@ class Visualise:
             self.viewport.blit(self.rwd, [0,0])
         
         self.draw_info_box(state)
-        pygame.display.flip()
+        if not self.headless:
+            pygame.display.flip()
+        self.drawn = None
+
+    # Draw parm state like draw_all_elements() does, but only draw again the parts of the viewport that have changed
+    # since the last frame; the car, the new column of the speed graph, the reward overlay and whichever of the info
+    # box's text and pie charts are different. Only those parts of the window are updated. Returns the list of rects
+    # of the viewport that were drawn.
+    def draw_changed_elements(self, state):
+        self.count_state(state)
+        (colour, lines) = self.car_lines(state)
+        car_rect = self.car_rect(lines)
+        items = self.info_box_items(state)
+        item_rects = [self.item_rect(item) for item in items]
+
+        viewport_rect = self.viewport.get_rect()
+        if self.drawn is None or self.drawn[4] != self.show_reward_info:
+            rects = [viewport_rect]
+        else:
+            # The overlays that changed last frame, where the car was and is, and the info box items that changed.
+            (last_car_rect, last_items, last_item_rects, overlays_changed, _) = self.drawn
+            changed = overlays_changed + [last_car_rect, car_rect]
+            for (last_item, item, last_rect, rect) in zip(last_items, items, last_item_rects, item_rects):
+                if item != last_item:
+                    changed += [last_rect, rect]
+            rects = [rect.clip(viewport_rect) for rect in merge_rects(changed)]
+            rects = [rect for rect in rects if rect.width and rect.height]
+
+        for rect in rects:
+            # Everything that could be in the rect, in the same order as draw_all_elements() draws it.
+            self.viewport.set_clip(rect)
+            self.viewport.fill(self.DARKGREEN)
+            self.draw_track()
+            for (v1, v2) in lines:
+                pygame.draw.line(self.viewport, colour, v1, v2, CAR_LINE_WIDTH)
+            self.viewport.blit(self.grp, [60,-20])
+            if self.show_reward_info:
+                self.viewport.blit(self.rwd, [0,0])
+            for (item, item_rect) in zip(items, item_rects):
+                if rect.colliderect(item_rect):
+                    self.draw_item(item)
+        self.viewport.set_clip(None)
+
+        # The overlays are added to after they are drawn, the same as draw_all_elements() does.
+        overlays_changed = self.draw_overlays(state)
+        self.drawn = (car_rect, items, item_rects, overlays_changed, self.show_reward_info)
+        if not self.headless:
+            pygame.display.update(rects)
+        return rects
 
     # Do animation of all statuses, showing car going around the track.
-    def animate(self):
+    # If parm episode is a episode number, only the statuses of that episode are animated.
+    # Headless, each status is drawn once, and then it returns.
+    def animate(self, episode=None):
         # Loop until the user clicks the close button.
         done = False
         clock = pygame.time.Clock()
@@ -445,42 +692,34 @@ class Visualise:
 
         while not done:
             if go:
-                self.NCOT =0
-                self.QNCOT=0
-                self.HIRD=0
-                self.TH=0
-                self.GS=0
-                self.GF=0
-                self.GSL=0
-                self.CC=0
-                self.speed_count=0
-                self.GRWD=0 # good reward
-                self.BRWD=0 # bad reward
-                self.OKRWD=0 # okay reward
-                self.SMRWD=0 # small reward
-                
-                self.grp.fill(255)
-                self.rwd.fill(255)
-                
-                for s in self.track.statuses:
-
-                    # This limits the while loop to a max of 10 times per second.
-                    # Leave this out and we will use all CPU we can.
-                    clock.tick(10)
-                           
-
-                    for event in pygame.event.get():  # User did something
-                        if event.type == pygame.QUIT:  # If user clicked close
-                            done = True  # Flag that we are done so we exit this loop
-                        if event.type == pygame.KEYDOWN:
-                            if event.key == pygame.K_SPACE: #switch off reward display
-                                self.show_reward_info=not self.show_reward_info   
+                self.reset_overlays()
+
+                statuses = self.statuses_to_draw(None, episode)
+
+                for s in statuses:
+
+                    # Headless, there is no window to watch or take events from, so draw as fast as possible.
+                    if not self.headless:
+                        # This limits the while loop to a max of 10 times per second.
+                        # Leave this out and we will use all CPU we can.
+                        clock.tick(10)
+
+                        for event in pygame.event.get():  # User did something
+                            if event.type == pygame.QUIT:  # If user clicked close
+                                done = True  # Flag that we are done so we exit this loop
+                            if event.type == pygame.KEYDOWN:
+                                if event.key == pygame.K_SPACE: #switch off reward display
+                                    self.show_reward_info=not self.show_reward_info   
+                            if event.type == pygame.VIDEOEXPOSE:  # Window needs drawing again, all of it.
+                                self.drawn = None
             
-                    self.draw_all_elements(s)
+                    self.draw_changed_elements(s)
 
                     if done:
                         break
                 go=False
+                if self.headless:
+                    done = True     # Nobody to press ENTER to start again.
                 #horrible to do this again!!!!!!
                 while not done and not go:
                     for event in pygame.event.get():  # User did something
@@ -495,23 +734,153 @@ class Visualise:
             # Be IDLE friendly
         pygame.quit()
 
-    # For the first 10 statuses, draw them onscreen, and save each one to a screenshot .PNG file.
-    # Then make an animated GIF out of the screenshots.
-    def make_gif(self, screenshots_prefix, gif_filename):
-        counter = 1
-        filenames = []
-
-        for s in self.track.statuses[1:90]:                  # Take a nice set of statuses to make into the GIF.
-            self.draw_all_elements(s)
-
-            screenshot_name = 'screenshots/' + screenshots_prefix + format(counter, '02') + '.png'
-            pygame.image.save(self.viewport, screenshot_name)
+    # Return the viewport, scaled to parm size, a [width, height], if it isn't None.
+    def frame_surface(self, size=None):
+        if size is not None and list(size) != self.viewport_size:
+            return pygame.transform.smoothscale(self.viewport, size)
+        return self.viewport
+
+    # Return the pixels of the viewport as a (height, width, 3) array, scaled to parm size if it isn't None. The array
+    # is a copy, not a view that would lock the viewport, as some imageio writers hold on to the last frame they got.
+    def frame_pixels(self, size=None):
+        surface = self.frame_surface(size)
+        (width, height) = surface.get_size()
+        return np.frombuffer(pygame.image.tobytes(surface, 'RGB'), dtype=np.uint8).reshape(height, width, 3)
+
+    # Return the statuses to draw, from the parm statuses, or else those of parm episode number, or else all of them.
+    def statuses_to_draw(self, statuses, episode):
+        if statuses is not None:
+            return statuses
+        if episode is not None:
+            return self.track.episode(episode)
+        return self.track.statuses
+
+    # Draw the parm statuses (by default all of them, or those of parm episode number) and write each frame straight
+    # into an imageio writer for parm filename, so that the frames never all need to be held in memory at once. The
+    # format comes from the extension of the filename, eg. .gif, or .mp4 if imageio-ffmpeg is installed.
+    # Only every parm stride'th status is drawn, and the frames are scaled to parm size, if it isn't None. If parm
+    # screenshots is not None, each frame is also saved as a .PNG file, <screenshots><frame number>.png
+    # Any other parm writer_options, eg. duration, are passed on to imageio.get_writer(). Returns the number of frames.
+    def export(self, filename, statuses=None, episode=None, stride=1, size=None, screenshots=None, **writer_options):
+        statuses = self.statuses_to_draw(statuses, episode)
+
+        frames = 0
+        with imageio.get_writer(filename, mode='I', **writer_options) as writer:
+            for s in itertools.islice(statuses, 0, None, stride):
+                self.draw_all_elements(s)
+                frames += 1
+                if screenshots is not None:
+                    pygame.image.save(self.viewport, screenshots + format(frames, '02') + '.png')
+
+                writer.append_data(self.frame_pixels(size))
+        return frames
+
+    # The same as export(), but the frames are drawn by parm processes worker processes (None means one per CPU), each
+    # with its own headless Visualise, and then written in order. Each frame only depends on its status and on the
+    # counters, speed graph and reward overlay built up by the statuses before it. Each worker is sent a snapshot of
+    # those once, when it starts, and is then handed tasks of parm frames_per_task statuses in turn, along with the
+    # statuses of the tasks that the other workers were handed since its last one, so that it can bring its own
+    # snapshot up to date, which is quick as nothing else is drawn. No more than FRAMES_IN_FLIGHT frames are drawn
+    # ahead of being written, or one task for each worker if that is more, so that every one of the parm processes is
+    # kept busy. Returns the number of frames.
+    def export_parallel(self, filename, statuses=None, episode=None, stride=1, size=None, processes=None,
+                        frames_per_task=FRAMES_PER_TASK, **writer_options):
+        statuses = itertools.islice(self.statuses_to_draw(statuses, episode), 0, None, stride)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        [width, height] = self.viewport_size if size is None else size
+        lanes = max(1, processes)
+        tasks_in_flight = max(lanes, FRAMES_IN_FLIGHT // frames_per_task)
+
+        context = multiprocessing.get_context('spawn')         # Don't fork pygame's display.
+        task_queues = [context.Queue() for _ in range(lanes)]
+        result_queues = [context.Queue() for _ in range(lanes)]
+        overlay = self.overlay_state()
+        workers = [context.Process(target=export_worker, daemon=True,
+                                   args=(self.track, self.show_reward_info, overlay, size, tasks, results))
+                   for (tasks, results) in zip(task_queues, result_queues)]
+        for worker in workers:
+            worker.start()
+
+        history = collections.deque(maxlen=lanes - 1)           # Chunks handed out since each worker's last one.
+        pending = collections.deque()                           # Workers of the tasks in flight, oldest first.
+        handed_out = 0
+        frames = 0
+        try:
+            with imageio.get_writer(filename, mode='I', **writer_options) as writer:
+                while True:
+                    while len(pending) < tasks_in_flight:
+                        chunk = list(itertools.islice(statuses, frames_per_task))
+                        if not chunk:
+                            break
+                        lane = handed_out % lanes
+                        task_queues[lane].put((list(itertools.chain.from_iterable(history)), chunk))
+                        history.append(chunk)
+                        pending.append(lane)
+                        handed_out += 1
+                        for s in chunk:
+                            self.advance(s)
+                    if not pending:
+                        break
 
-            filenames.append(screenshot_name)
-            counter += 1
+                    lane = pending.popleft()
+                    for pixels in receive_frames(result_queues[lane], workers[lane]):
+                        writer.append_data(np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3))
+                        frames += 1
+            for tasks in task_queues:
+                tasks.put(None)                                 # No more tasks.
+            for worker in workers:
+                worker.join()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+        return frames
+
+    # Draw the statuses from parm first up to (but not including) parm last, and make an animated GIF of them, in
+    # screenshots/<parm gif_filename>. If parm screenshots_prefix is not None, each frame is also saved as a .PNG file
+    # in screenshots/ too. See export() for parm stride and size.
+    def make_gif(self, screenshots_prefix, gif_filename, first=1, last=90, stride=1, size=None):
+        if screenshots_prefix is not None:
+            screenshots_prefix = 'screenshots/' + screenshots_prefix
+        statuses = itertools.islice(self.track.statuses, first, last)
+        self.export('screenshots/' + gif_filename, statuses, stride=stride, size=size, screenshots=screenshots_prefix)
         pygame.quit()
 
-        images = []
-        for filename in filenames:
-            images.append(imageio.imread(filename))
-        imageio.mimsave('screenshots/' + gif_filename, images)
+
+# Run a worker process of Visualise.export_parallel(), with its own headless Visualise of parm track, starting from
+# parm overlay, a snapshot made by Visualise.overlay_state(). Each task from the parm tasks queue is a tuple of (list
+# of statuses drawn by the other workers since this one's last task, list of statuses to draw), and the pixels of each
+# frame, as RGB bytes, are put in a list on the parm results queue. A task of None means there are no more. If drawing
+# fails, the exception is put on the results queue instead.
+def export_worker(track, show_reward_info, overlay, size, tasks, results):
+    try:
+        screen = Visualise(track, headless=True)
+        screen.show_reward_info = show_reward_info
+        screen.set_overlay_state(overlay)
+        for (catch_up, statuses) in iter(tasks.get, None):
+            for s in catch_up:
+                screen.advance(s)
+            frames = []
+            for s in statuses:
+                screen.draw_all_elements(s)
+                frames.append(pygame.image.tobytes(screen.frame_surface(size), 'RGB'))
+            results.put(frames)
+    except Exception as error:
+        results.put(error)
+
+
+# Return the next list of frames from parm results queue of an export_worker(), raising its exception if drawing
+# failed, or a RuntimeError if parm worker process stopped without saying why.
+def receive_frames(results, worker):
+    while True:
+        alive = worker.is_alive()                   # Before looking in the queue, so its last words aren't missed.
+        try:
+            frames = results.get(timeout=WORKER_POLL_SECONDS)
+        except queue.Empty:
+            if not alive:
+                raise RuntimeError('Export worker process stopped, with exit code ' + str(worker.exitcode))
+            continue
+        if isinstance(frames, Exception):
+            raise frames
+        return frames